@@ -18,21 +18,93 @@ Date: 2024
 """
 
 import os
+import io
+import csv
+import logging
 import pandas as pd
 from datetime import datetime
 import time
 import random
 import re
 import json
+import threading
+import collections
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from chatgpt.chatgpt_request import ChatGPT
+from claude.claude_request import Claude
+
+log = logging.getLogger(__name__)
 
 # Get the list of folders in the datasets directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
 datasets_file_path = os.path.join(current_dir, '../datasets')
-datetime_folders = [folder for folder in os.listdir(datasets_file_path) if os.path.isdir(os.path.join(datasets_file_path, folder))]
+datetime_folders = [entry.name for entry in os.scandir(datasets_file_path) if entry.is_dir()]
+
+# Dataset columns that never hold model responses
+META_COLS = frozenset({'page', 'rank', 'source', 'title', 'content', 'url', 'Article_Content'})
+
+# Dataset columns needed to build the prompts and key the cache; read as strings
+DATASET_COLS = frozenset({'url', 'title', 'Article_Content'})
+
+# Number of articles sent to the LLM APIs concurrently
+MAX_WORKERS = 16
+
+# Number of result rows buffered before the partial result file is flushed
+WRITE_BATCH_SIZE = 32
 
-# Cache dictionary to store results based on model_version and URL
+# Cache of results keyed by (model_persona_key, url)
 results_cache = {}
 
+# Guards results_cache writes from worker threads
+_cache_lock = threading.Lock()
+
+# Per-thread pool of long-lived API clients
+_clients = threading.local()
+
+def read_result_file(file_path, usecols=None):
+    """
+    Read a result CSV, keeping only the complete rows of a '.csv.partial' file.
+    
+    A run killed while writing can leave a partial file that ends in the middle
+    of a row, possibly inside a quoted field. The rows are scanned with the csv
+    module and the incomplete trailing record is dropped before parsing.
+    
+    Args:
+        file_path (str): Path to the result file
+        usecols (callable, optional): Column filter passed to pd.read_csv
+        
+    Returns:
+        pd.DataFrame: Loaded results
+    """
+    if not file_path.endswith('.partial'):
+        return pd.read_csv(file_path, usecols=usecols)
+
+    with open(file_path, newline='', encoding='utf-8') as f:
+        text = f.read()
+
+    # Offset just past the last record that ends with a line terminator
+    consumed = 0
+    complete_end = 0
+
+    def lines():
+        nonlocal consumed
+        for line in io.StringIO(text, newline=''):
+            consumed += len(line)
+            yield line
+
+    try:
+        for _ in csv.reader(lines(), strict=True):
+            if text[consumed - 1] in '\r\n':
+                complete_end = consumed
+    except csv.Error:
+        pass  # The file ends inside a quoted field
+
+    if complete_end == 0:
+        return pd.DataFrame(columns=['url'])
+    return pd.read_csv(io.StringIO(text[:complete_end]), usecols=usecols)
+
+
 def load_existing_results(results_folder):
     """
     Load existing analysis results from CSV files to populate cache.
@@ -46,19 +118,43 @@ def load_existing_results(results_folder):
     """
     for root, dirs, files in os.walk(results_folder):
         for file in files:
-            if file.endswith('.csv'):
+            # '.csv.partial' files are left behind by interrupted runs
+            if file.endswith(('.csv', '.csv.partial')):
                 file_path = os.path.join(root, file)
-                df = pd.read_csv(file_path)
+                # Only the url and model-persona columns are needed; skip article text
+                try:
+                    df = read_result_file(file_path, usecols=lambda col: col == 'url' or col not in META_COLS)
+                except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+                    print(f"Skipping unreadable result file {file_path}: {e}")
+                    continue
                 for model_version in df.columns:
-                    if model_version not in ['page', 'rank', 'source', 'title', 'content', 'url', 'Article_Content']:
-                        if model_version not in results_cache:
-                            results_cache[model_version] = {}
-                        for _, row in df.iterrows():
-                            if pd.notna(row[model_version]) and row[model_version] != "":
-                                results_cache[model_version][row['url']] = row[model_version]
-    print(f"Loaded {sum(len(model_cache) for model_cache in results_cache.values())} cached results.")
-    for model_version, model_cache in results_cache.items():
-        print(f"{model_version}: {len(model_cache)} cached results")
+                    if model_version not in META_COLS:
+                        for url, value in zip(df['url'], df[model_version]):
+                            if pd.notna(value) and value != "":
+                                results_cache[(model_version, url)] = value
+    print(f"Loaded {len(results_cache)} cached results.")
+    for model_version, cache_count in collections.Counter(key for key, _ in results_cache).items():
+        print(f"{model_version}: {cache_count} cached results")
+
+
+def get_client(client_class, model_version):
+    """
+    Get the calling thread's client for a model version, creating it on first use.
+    
+    Args:
+        client_class (type): API client class (ChatGPT or Claude)
+        model_version (str): Model version the client is bound to
+        
+    Returns:
+        ChatGPT or Claude: Client instance reused across calls on this thread
+    """
+    pool = getattr(_clients, 'pool', None)
+    if pool is None:
+        pool = _clients.pool = {}
+    key = (client_class.__name__, model_version)
+    if key not in pool:
+        pool[key] = client_class(model_version)
+    return pool[key]
 
 
 def create_chatgpt_content(query, title, text, chatgpt_model_version_list):
@@ -87,15 +183,14 @@ def create_chatgpt_content(query, title, text, chatgpt_model_version_list):
     content_prompt = create_content_prompt(query, title, text)
     
     for model_version in chatgpt_model_version_list:
-        from chatgpt.chatgpt_request import ChatGPT
-        print(f"Processing ChatGPT model version: {model_version}")
+        log.debug(f"Processing ChatGPT model version: {model_version}")
         
         for persona, role_prompt in role_prompts.items():
             model_persona_key = f"{model_version}_{persona}"
-            print(f"Processing persona: {persona}")
+            log.debug(f"Processing persona: {persona}")
             
-            chatgpt = ChatGPT(model_version)
-            chatgpt.add_role(role_prompt)
+            chatgpt = get_client(ChatGPT, model_version)
+            chatgpt.reset_role(role_prompt)
             response = chatgpt.run(content_prompt)
             responses[model_persona_key] = response if response else create_empty_result_json()
             
@@ -131,15 +226,14 @@ def create_claude_content(query, title, text, claude_model_version_list):
     content_prompt = create_content_prompt(query, title, text)
     
     for model_version in claude_model_version_list:
-        from claude.claude_request import Claude
-        print(f"Processing Claude model version: {model_version}")
+        log.debug(f"Processing Claude model version: {model_version}")
         
         for persona, role_prompt in role_prompts.items():
             model_persona_key = f"{model_version}_{persona}"
-            print(f"Processing persona: {persona}")
+            log.debug(f"Processing persona: {persona}")
             
-            claude = Claude(model_version)
-            claude.add_role(role_prompt)
+            claude = get_client(Claude, model_version)
+            claude.reset_role(role_prompt)
             response = claude.run(content_prompt)
             responses[model_persona_key] = response if response else create_empty_result_json()
             
@@ -148,6 +242,21 @@ def create_claude_content(query, title, text, claude_model_version_list):
     
     return responses
 
+@functools.lru_cache(maxsize=None)
+def _load_template(prompt_file_path):
+    """
+    Read a prompt template file, caching its contents after the first read.
+    
+    Args:
+        prompt_file_path (str): Path to the prompt template file
+        
+    Returns:
+        str: Unformatted prompt template
+    """
+    with open(prompt_file_path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
 def create_role_opposed_left_prompt(query):
     """
     Create a left-leaning opposed perspective prompt.
@@ -158,11 +267,7 @@ def create_role_opposed_left_prompt(query):
     Returns:
         str: Formatted prompt for left-leaning opposed perspective
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    prompt_file_path = os.path.join(current_dir, 'prompt', 'prompt_role_opposed_left.txt')
-    with open(prompt_file_path, 'r', encoding='utf-8') as file:
-        prompt_template = file.read()
-    return prompt_template.format(query=query)
+    return _load_template(os.path.join(current_dir, 'prompt', 'prompt_role_opposed_left.txt')).format(query=query)
 
 
 def create_role_opposed_right_prompt(query):
@@ -175,11 +280,7 @@ def create_role_opposed_right_prompt(query):
     Returns:
         str: Formatted prompt for right-leaning opposed perspective
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    prompt_file_path = os.path.join(current_dir, 'prompt', 'prompt_role_opposed_right.txt')
-    with open(prompt_file_path, 'r', encoding='utf-8') as file:
-        prompt_template = file.read()
-    return prompt_template.format(query=query)
+    return _load_template(os.path.join(current_dir, 'prompt', 'prompt_role_opposed_right.txt')).format(query=query)
 
 
 def create_role_supportive_left_prompt(query):
@@ -192,11 +293,7 @@ def create_role_supportive_left_prompt(query):
     Returns:
         str: Formatted prompt for left-leaning supportive perspective
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    prompt_file_path = os.path.join(current_dir, 'prompt', 'prompt_role_supportive_left.txt')
-    with open(prompt_file_path, 'r', encoding='utf-8') as file:
-        prompt_template = file.read()
-    return prompt_template.format(query=query)
+    return _load_template(os.path.join(current_dir, 'prompt', 'prompt_role_supportive_left.txt')).format(query=query)
 
 
 def create_role_supportive_right_prompt(query):
@@ -209,11 +306,7 @@ def create_role_supportive_right_prompt(query):
     Returns:
         str: Formatted prompt for right-leaning supportive perspective
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    prompt_file_path = os.path.join(current_dir, 'prompt', 'prompt_role_supportive_right.txt')
-    with open(prompt_file_path, 'r', encoding='utf-8') as file:
-        prompt_template = file.read()
-    return prompt_template.format(query=query)
+    return _load_template(os.path.join(current_dir, 'prompt', 'prompt_role_supportive_right.txt')).format(query=query)
 
 
 def create_content_prompt(query, title, text):
@@ -228,11 +321,21 @@ def create_content_prompt(query, title, text):
     Returns:
         str: Formatted content analysis prompt
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    prompt_file_path = os.path.join(current_dir, 'prompt', 'prompt_content.txt')
-    with open(prompt_file_path, 'r', encoding='utf-8') as file:
-        prompt_template = file.read()
-    return prompt_template.format(query=query, title=title, text=text)
+    return _load_template(os.path.join(current_dir, 'prompt', 'prompt_content.txt')).format(query=query, title=title, text=text)
+
+
+# Serialized once; the empty result never changes
+_EMPTY_RESULT_JSON = json.dumps({
+    "Political": {
+        "label": None,
+        "score": None
+    },
+    "Stance": {
+        "label": None,
+        "score": None
+    },
+    "Reasoning": None
+})
 
 
 def create_empty_result_json():
@@ -242,18 +345,7 @@ def create_empty_result_json():
     Returns:
         str: JSON string with empty analysis structure
     """
-    empty_result = {
-        "Political": {
-            "label": None,
-            "score": None
-        },
-        "Stance": {
-            "label": None,
-            "score": None
-        },
-        "Reasoning": None
-    }
-    return json.dumps(empty_result)
+    return _EMPTY_RESULT_JSON
 
 def get_df(datetime_range, claude_model_version_list, chatgpt_model_version_list, endswith_date):
     """
@@ -278,8 +370,7 @@ def get_df(datetime_range, claude_model_version_list, chatgpt_model_version_list
         load_existing_results(results_folder)
     
     # Process each date folder within range
-    datetime_folders = sorted([folder for folder in os.listdir(datasets_file_path) 
-                              if os.path.isdir(os.path.join(datasets_file_path, folder))])
+    datetime_folders = sorted(entry.name for entry in os.scandir(datasets_file_path) if entry.is_dir())
     
     for datetime_folder in datetime_folders:
         try:
@@ -309,18 +400,16 @@ def process_date_folder(datetime_folder, claude_model_version_list, chatgpt_mode
         personas (list): List of persona types to process
     """
     pir_path = os.path.join(datasets_file_path, datetime_folder)
-    pir_folders = sorted([folder for folder in os.listdir(pir_path) 
-                         if os.path.isdir(os.path.join(pir_path, folder))])
+    pir_folders = sorted(entry.name for entry in os.scandir(pir_path) if entry.is_dir())
 
     for pir_folder in pir_folders:
         pf_path = os.path.join(pir_path, pir_folder)
-        pf_folders = sorted([folder for folder in os.listdir(pf_path) 
-                            if os.path.isdir(os.path.join(pf_path, folder))])
+        pf_folders = sorted(entry.name for entry in os.scandir(pf_path) if entry.is_dir())
         
         for pf_folder in pf_folders:
             final_path = os.path.join(pf_path, pf_folder)
-            csv_files = sorted([file for file in os.listdir(final_path) 
-                               if file.endswith('.csv')])
+            csv_files = sorted(entry.name for entry in os.scandir(final_path)
+                               if entry.is_file() and entry.name.endswith('.csv'))
             
             for file in csv_files:
                 dataset_file_path = os.path.join(final_path, file)
@@ -329,6 +418,62 @@ def process_date_folder(datetime_folder, claude_model_version_list, chatgpt_mode
                                    endswith_date, personas)
 
 
+def process_row(url, title, text, query, row, model_lists, personas):
+    """
+    Collect the missing model-persona responses for a single article.
+    
+    Runs on a worker thread, so it only reads the row snapshot it is given
+    and returns the new values instead of writing to the DataFrame.
+    
+    Args:
+        url (str): Article URL used as the cache key
+        title (str): The article title
+        text (str): The article content
+        query (str): The search query used to find the article
+        row (dict): Current value of each model-persona column for this article
+        model_lists (list): (model_version_list, create_func) pairs to process
+        personas (list): Persona types
+        
+    Returns:
+        dict: New responses keyed by model-persona column
+    """
+    updates = {}
+    for model_list, create_func in model_lists:
+        for model_version in model_list:
+            responses_needed = False
+            for persona in personas:
+                model_persona_key = f"{model_version}_{persona}"
+                if not (pd.isna(row[model_persona_key]) or row[model_persona_key] == ""):
+                    continue
+
+                # Check if URL is already in cache
+                cached = results_cache.get((model_persona_key, url))
+                if cached is not None:
+                    log.debug(f"Using cached result for {model_persona_key} and URL: {url}")
+                    updates[model_persona_key] = cached
+                else:
+                    responses_needed = True
+                    break
+
+            # If responses are needed, call the API once for all personas
+            if responses_needed:
+                log.debug(f"Generating new responses for {model_version}")
+                try:
+                    responses = create_func(query, title, text, [model_version])
+                    for persona in personas:
+                        model_persona_key = f"{model_version}_{persona}"
+                        if model_persona_key not in updates and (pd.isna(row[model_persona_key]) or row[model_persona_key] == ""):
+                            response = responses[model_persona_key]
+                            updates[model_persona_key] = response
+                            # Store new response in cache
+                            with _cache_lock:
+                                results_cache[(model_persona_key, url)] = response
+                except Exception as e:
+                    print(f"Error processing {model_version}: {str(e)}")
+                    continue
+    return updates
+
+
 def process_single_file(dataset_file_path, file, datetime_folder, pir_folder, pf_folder,
                        claude_model_version_list, chatgpt_model_version_list, endswith_date, personas):
     """
@@ -346,7 +491,8 @@ def process_single_file(dataset_file_path, file, datetime_folder, pir_folder, pf
         personas (list): Persona types
     """
     try:
-        df = pd.read_csv(dataset_file_path)
+        # Every dataset column is kept for the result file; only the prompt columns are typed
+        df = pd.read_csv(dataset_file_path, dtype={col: 'string' for col in DATASET_COLS})
         print(f"Loaded dataset: {dataset_file_path} ({len(df)} articles)")
         
         if 'Article_Content' not in df.columns:
@@ -362,87 +508,120 @@ def process_single_file(dataset_file_path, file, datetime_folder, pir_folder, pf
         print(f"Processing: Date={datetime_folder}, PIR={pir_folder}, PF={pf_folder}, Query={query}, PF Details={pf}")
 
         # Prepare result file path
+        final_path = os.path.dirname(dataset_file_path)
         result_final_path = final_path.replace('../datasets', f'../result_folder/results_{endswith_date}')
         result_file_path = os.path.join(result_final_path, file)
         os.makedirs(result_final_path, exist_ok=True)
 
-        # Load existing result file if it exists
-        existing_columns = set()
+        # Only the header of an existing result file is read; its values are
+        # already in results_cache via load_existing_results
+        existing_columns = []
         if os.path.exists(result_file_path):
-            existing_df = pd.read_csv(result_file_path)
-            for col in existing_df.columns:
-                if col not in ['page', 'rank', 'source', 'title', 'content', 'url', 'Article_Content']:
-                    df[col] = existing_df[col]
-                    existing_columns.add(col)
+            existing_columns = [col for col in pd.read_csv(result_file_path, nrows=0).columns
+                                if col not in META_COLS]
         
-        # Initialize only necessary new columns
         all_model_versions = chatgpt_model_version_list + claude_model_version_list
-        for model_version in all_model_versions:
-            for persona in personas:
-                model_persona_key = f"{model_version}_{persona}"
-                if model_persona_key not in existing_columns:
-                    df[model_persona_key] = ""
-                # Initialize cache dictionary
-                if model_persona_key not in results_cache:
-                    results_cache[model_persona_key] = {}
-
-        # Set to track processing status by URL
-        processed_urls = set()
-
-        # Process each article
-        for i, (url, title, text) in enumerate(zip(df['url'].tolist(), df['title'].tolist(), df['Article_Content'].tolist())):
-            print(f"\nProcessing article {i+1}/{len(df)}")
-            row_updated = False
-
-            # Process each model type
-            for model_list, create_func in [
-                (chatgpt_model_version_list, create_chatgpt_content),
-                (claude_model_version_list, create_claude_content)
-            ]:
-                for model_version in model_list:
-                    responses_needed = False
-                    for persona in personas:
-                        model_persona_key = f"{model_version}_{persona}"
-                        
-                        # Check if URL is already in cache
-                        if url in results_cache[model_persona_key]:
-                            if pd.isna(df.at[i, model_persona_key]) or df.at[i, model_persona_key] == "":
-                                print(f"Using cached result for {model_persona_key} and URL: {url}")
-                                df.at[i, model_persona_key] = results_cache[model_persona_key][url]
-                                row_updated = True
-                        elif pd.isna(df.at[i, model_persona_key]) or df.at[i, model_persona_key] == "":
-                            responses_needed = True
-                            break
-                    
-                    # If responses are needed, call the API once for all personas
-                    if responses_needed:
-                        print(f"Generating new responses for {model_version}")
-                        try:
-                            responses = create_func(query, title, text, [model_version])
-                            for persona in personas:
-                                model_persona_key = f"{model_version}_{persona}"
-                                if pd.isna(df.at[i, model_persona_key]) or df.at[i, model_persona_key] == "":
-                                    response = responses[model_persona_key]
-                                    df.at[i, model_persona_key] = response
-                                    # Store new response in cache
-                                    results_cache[model_persona_key][url] = response
-                                    row_updated = True
-                        except Exception as e:
-                            print(f"Error processing {model_version}: {str(e)}")
-                            continue
-
-            # Save results after each article if updated
-            if row_updated:
-                df.to_csv(result_file_path, index=False)
-                print(f"Updated results saved to {result_file_path}")
-                
-                # Print cache status
-                print("\nCurrent cache status:")
-                for model_version in all_model_versions:
-                    for persona in personas:
-                        model_persona_key = f"{model_version}_{persona}"
-                        cache_count = len(results_cache[model_persona_key])
-                        print(f"{model_persona_key}: {cache_count} cached results")
+        all_keys = [f"{model_version}_{persona}" for model_version in all_model_versions for persona in personas]
+
+        # Fill previous and new result columns from the cache and attach them in one concat
+        urls = df['url'].tolist()
+        cached_columns = {
+            col: [results_cache.get((col, url), "") for url in urls]
+            for col in dict.fromkeys(existing_columns + all_keys)
+        }
+        df = pd.concat([df, pd.DataFrame(cached_columns, index=df.index, dtype=object)], axis=1)
+
+        model_lists = [
+            (chatgpt_model_version_list, create_chatgpt_content),
+            (claude_model_version_list, create_claude_content)
+        ]
+
+        # Responses are collected in plain per-column lists and assigned to df once at the end
+        result_columns = {key: df[key].tolist() for key in all_keys}
+        column_values = [result_columns[col] if col in result_columns else df[col].tolist() for col in df.columns]
+
+        # Rows are streamed to a partial file and moved into place once the file is done.
+        # They are collected in an in-memory batch and written whole, so the file on
+        # disk only ever ends on a row boundary (unless the write itself is cut short)
+        partial_file_path = f"{result_file_path}.partial"
+        batch = io.StringIO()
+        writer = csv.writer(batch)
+        pending_rows = 0
+
+        def write_batch():
+            nonlocal pending_rows
+            f.write(batch.getvalue())
+            f.flush()
+            batch.seek(0)
+            batch.truncate()
+            pending_rows = 0
+
+        with open(partial_file_path, 'w', newline='', encoding='utf-8') as f, \
+                ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            writer.writerow(df.columns)
+            write_batch()
+
+            # Fully cached articles are written as-is; only rows with an empty column are submitted
+            result_frame = df[all_keys]
+            needs_work = (result_frame.isna() | result_frame.eq("")).to_numpy().any(axis=1).tolist()
+
+            # Articles without usable text get the empty result instead of an API call
+            text_valid = (df['Article_Content'].str.strip().str.len() >= 10).fillna(False).tolist()
+            for i in range(len(df)):
+                if needs_work[i] and not text_valid[i]:
+                    for key in all_keys:
+                        if pd.isna(result_columns[key][i]) or result_columns[key][i] == "":
+                            result_columns[key][i] = create_empty_result_json()
+                    needs_work[i] = False
+
+            futures = {
+                executor.submit(process_row, url, title, text, query,
+                                {key: result_columns[key][i] for key in all_keys}, model_lists, personas): i
+                for i, (url, title, text) in enumerate(zip(urls, df['title'].tolist(), df['Article_Content'].tolist()))
+                if needs_work[i]
+            }
+            log.debug(f"{len(futures)}/{len(df)} articles need LLM calls")
+
+            completed_rows = {i for i, needed in enumerate(needs_work) if not needed}
+            next_row = 0
+
+            def write_ready_rows():
+                # Rows are written in dataset order once every earlier row is done
+                nonlocal next_row, pending_rows
+                while next_row in completed_rows:
+                    writer.writerow(['' if pd.isna(values[next_row]) else values[next_row] for values in column_values])
+                    completed_rows.discard(next_row)
+                    next_row += 1
+                    pending_rows += 1
+                    if pending_rows >= WRITE_BATCH_SIZE:
+                        write_batch()
+
+            write_ready_rows()
+            for future in as_completed(futures):
+                i = futures[future]
+                updates = future.result()
+                for model_persona_key, response in updates.items():
+                    result_columns[model_persona_key][i] = response
+                completed_rows.add(i)
+                log.debug(f"Finished article {i+1}/{len(df)}")
+                write_ready_rows()
+
+                # Log cache status
+                if updates and log.isEnabledFor(logging.DEBUG):
+                    log.debug("Current cache status:")
+                    with _cache_lock:
+                        cache_counts = collections.Counter(key for key, _ in results_cache)
+                    for model_persona_key in all_keys:
+                        log.debug(f"{model_persona_key}: {cache_counts[model_persona_key]} cached results")
+
+            # Rows left over from the last incomplete batch
+            write_batch()
+
+        for model_persona_key, values in result_columns.items():
+            df[model_persona_key] = values
+
+        os.replace(partial_file_path, result_file_path)
+        log.debug(f"Updated results saved to {result_file_path}")
 
         print(f"Finished processing {result_file_path}\n{'-'*80}")
         
@@ -451,6 +630,8 @@ def process_single_file(dataset_file_path, file, datetime_folder, pir_folder, pf
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
     # Configuration
     claude_model_version_list = [
         'claude-3-5-sonnet-20241022'
@@ -21,14 +21,46 @@ import json
 import re
 import pandas as pd
 from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from claude.claude_request import Claude
 from chatgpt.chatgpt_request import ChatGPT
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # orjson is optional; fall back to the stdlib parser
+    _json_loads = json.loads
+
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:  # pyarrow is optional; fall back to the pandas C parser
+    pyarrow = None
+
 current_dir = os.path.dirname(os.path.abspath(__file__))
 setting_date = '0921-30'
 datasets_file_path = os.path.join(current_dir, f'../result_folder/results_{setting_date}')
 results_file_path = os.path.join(current_dir, f'../result_folder/results_{setting_date}')
-datetime_folders = [folder for folder in os.listdir(datasets_file_path) if os.path.isdir(os.path.join(datasets_file_path, folder))]
+datetime_folders = [entry.name for entry in os.scandir(datasets_file_path) if entry.is_dir()]
+
+# Fields produced for every parsed model-persona column
+PARSED_FIELDS = ['Political_Label', 'Political_Score', 'Stance_Label', 'Stance_Score', 'Reasoning']
+
+# Regex patterns compiled once and shared by every parsed cell
+_JSON_PATTERNS = [re.compile(pattern, re.DOTALL) for pattern in (
+    r'\{[^{}]*"Political"[^{}]*"Stance"[^{}]*"Reasoning"[^{}]*\}',
+    r'\{.*?"Political":.*?"Stance":.*?"Reasoning":.*?\}',
+    r'\{.*?"Political":.*?"Bias":.*?\}',
+)]
+# Fallback extraction of every field in a single scan: (field, label, score) or reasoning
+_ALL_FIELDS_RE = re.compile(
+    r'"(Political|Stance)":\s*\{\s*"label":\s*(?:"([^"]+)")?(?:[^}]*?,"score":\s*(-?\d+\.?\d*))?'
+    r'|"Reasoning":\s*"(.*?)"',
+    re.DOTALL,
+)
+_NEWLINE_RE = re.compile(r'\n\s*')
+_SPACE_RE = re.compile(r'\s+')
 
 def get_model_persona_columns(df, model_version_list):
     """
@@ -67,9 +99,10 @@ def get_df(datetime_range, claude_model_version_list, chatgpt_model_version_list
     start_date = datetime.strptime(datetime_range[0], "%Y-%m-%d")
     end_date = datetime.strptime(datetime_range[1], "%Y-%m-%d")
     
-    datetime_folders = sorted([folder for folder in os.listdir(datasets_file_path) 
-                              if os.path.isdir(os.path.join(datasets_file_path, folder))])
+    datetime_folders = sorted(entry.name for entry in os.scandir(datasets_file_path) if entry.is_dir())
     
+    # Collect file paths first; parsing is CPU-bound and runs in worker processes
+    dataset_file_paths = []
     for datetime_folder in datetime_folders:
         folder_date = datetime.strptime(datetime_folder, "%Y-%m-%d")
         if folder_date < start_date or folder_date > end_date:
@@ -77,22 +110,63 @@ def get_df(datetime_range, claude_model_version_list, chatgpt_model_version_list
             continue
         
         pir_path = os.path.join(datasets_file_path, datetime_folder)
-        pir_folders = sorted([folder for folder in os.listdir(pir_path) 
-                             if os.path.isdir(os.path.join(pir_path, folder))])
+        pir_folders = sorted(entry.name for entry in os.scandir(pir_path) if entry.is_dir())
 
         for pir_folder in pir_folders:
             pf_path = os.path.join(pir_path, pir_folder)
-            pf_folders = sorted([folder for folder in os.listdir(pf_path) 
-                                if os.path.isdir(os.path.join(pf_path, folder))])
+            pf_folders = sorted(entry.name for entry in os.scandir(pf_path) if entry.is_dir())
             
             for pf_folder in pf_folders:
                 final_path = os.path.join(pf_path, pf_folder)
-                csv_files = sorted([file for file in os.listdir(final_path) 
-                                  if file.endswith('.csv') and not file.startswith('finetune_classified_updated_')])
+                csv_files = sorted(entry.name for entry in os.scandir(final_path)
+                                  if entry.is_file() and entry.name.endswith('.csv') and not entry.name.startswith('finetune_classified_updated_'))
                 
                 for file in csv_files:
-                    dataset_file_path = os.path.join(final_path, file)
-                    process_csv_file(dataset_file_path, claude_model_version_list, chatgpt_model_version_list)
+                    dataset_file_paths.append(os.path.join(final_path, file))
+
+    # Batch several files per task so small files don't pay one IPC round trip each
+    max_workers = os.cpu_count() or 1
+    chunksize = max(1, len(dataset_file_paths) // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(partial(process_csv_file,
+                                  claude_model_version_list=claude_model_version_list,
+                                  chatgpt_model_version_list=chatgpt_model_version_list),
+                          dataset_file_paths, chunksize=chunksize))
+
+
+def read_result_csv(file_path):
+    """
+    Read a result CSV, using the multithreaded pyarrow parser when available.
+    
+    Args:
+        file_path (str): Path to the CSV file
+        
+    Returns:
+        pd.DataFrame: Loaded data
+    """
+    if pyarrow is not None:
+        return pd.read_csv(file_path, engine='pyarrow', dtype_backend='pyarrow')
+    return pd.read_csv(file_path)
+
+
+def write_result_csv(df, output_path):
+    """
+    Write a DataFrame to CSV, using pyarrow's CSV writer when available.
+    
+    Columns that Arrow cannot type (e.g. numbers mixed with strings) fall
+    back to DataFrame.to_csv.
+    
+    Args:
+        df (pd.DataFrame): Data to write
+        output_path (str): Destination CSV path
+    """
+    if pyarrow is not None:
+        try:
+            pyarrow.csv.write_csv(pyarrow.Table.from_pandas(df, preserve_index=False), output_path)
+            return
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            pass
+    df.to_csv(output_path, index=False)
 
 
 def process_csv_file(dataset_file_path, claude_model_version_list, chatgpt_model_version_list):
@@ -109,7 +183,7 @@ def process_csv_file(dataset_file_path, claude_model_version_list, chatgpt_model
         return
         
     print(f"Processing file: {dataset_file_path}")
-    df = pd.read_csv(dataset_file_path)
+    df = read_result_csv(dataset_file_path)
     
     all_model_versions = claude_model_version_list + chatgpt_model_version_list
     model_persona_columns = get_model_persona_columns(df, all_model_versions)
@@ -118,26 +192,19 @@ def process_csv_file(dataset_file_path, claude_model_version_list, chatgpt_model
         print(f"No model-persona columns found in {dataset_file_path}")
         return
     
-    # Create new columns for parsed results
+    # Parse each model-persona column as a whole and attach all parsed columns in one concat
+    parsed_frames = []
     for column in model_persona_columns:
-        for field in ['Political_Label', 'Political_Score', 'Stance_Label', 'Stance_Score', 'Reasoning']:
-            new_column_name = f"{column}_{field}"
-            if new_column_name not in df.columns:
-                df[new_column_name] = None
-    
-    # Process each row
-    for index, row in df.iterrows():
-        for column in model_persona_columns:
-            raw_response = row[column]
-            if pd.notna(raw_response) and raw_response != "":
-                parsed_result = parse_response(raw_response)
-                if parsed_result:
-                    for field, value in parsed_result.items():
-                        df.at[index, f"{column}_{field}"] = value
+        raw_responses = df[column]
+        has_response = raw_responses.notna() & (raw_responses != "")
+        parsed = parse_responses(raw_responses[has_response]).reindex(df.index)
+        parsed_frames.append(parsed.add_prefix(f"{column}_"))
+    parsed_df = pd.concat(parsed_frames, axis=1)
+    df = pd.concat([df.drop(columns=parsed_df.columns, errors='ignore'), parsed_df], axis=1)
     
     # Save the updated dataframe
     output_path = dataset_file_path.replace('.csv', '_parsed.csv')
-    df.to_csv(output_path, index=False)
+    write_result_csv(df, output_path)
     print(f"Parsed results saved to: {output_path}")
 
 
@@ -161,8 +228,8 @@ def clean_json_string(json_string):
     
     # Clean up common formatting issues
     cleaned = extracted_json.strip()
-    cleaned = re.sub(r'\n\s*', ' ', cleaned)  # Remove newlines and extra spaces
-    cleaned = re.sub(r'\s+', ' ', cleaned)    # Normalize spaces
+    cleaned = _NEWLINE_RE.sub(' ', cleaned)  # Remove newlines and extra spaces
+    cleaned = _SPACE_RE.sub(' ', cleaned)    # Normalize spaces
     
     return cleaned
 
@@ -181,20 +248,53 @@ def robust_json_extract(text):
         return None
     
     # Strategy 1: Look for complete JSON objects
-    json_patterns = [
-        r'\{[^{}]*"Political"[^{}]*"Stance"[^{}]*"Reasoning"[^{}]*\}',
-        r'\{.*?"Political":.*?"Stance":.*?"Reasoning":.*?\}',
-        r'\{.*?"Political":.*?"Bias":.*?\}',
-    ]
-    
-    for pattern in json_patterns:
-        match = re.search(pattern, text, re.DOTALL)
+    for pattern in _JSON_PATTERNS:
+        match = pattern.search(text)
         if match:
             return match.group(0)
     
     return None
 
 
+def decode_response(clean_string):
+    """
+    Decode a cleaned JSON string into the flat parsed-field structure.
+    
+    Args:
+        clean_string (str): JSON string prepared by clean_json_string
+        
+    Returns:
+        dict: Parsed analysis data keyed by PARSED_FIELDS
+    """
+    try:
+        data = _json_loads(clean_string)
+    except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses this
+        # Fallback: Manual extraction using regex
+        data = {'Political': {'label': None, 'score': None},
+                'Stance': {'label': None, 'score': None},
+                'Reasoning': None}
+        seen = set()
+        for match in _ALL_FIELDS_RE.finditer(clean_string):
+            field, label, score, reasoning = match.groups()
+            if field is None:
+                field = 'Reasoning'
+            if field in seen:
+                continue
+            seen.add(field)
+            if field == 'Reasoning':
+                data['Reasoning'] = reasoning
+            else:
+                data[field] = {'label': label, 'score': float(score) if score else None}
+
+    return {
+        'Political_Label': data.get('Political', {}).get('label'),
+        'Political_Score': data.get('Political', {}).get('score'),
+        'Stance_Label': data.get('Stance', {}).get('label'),
+        'Stance_Score': data.get('Stance', {}).get('score'),
+        'Reasoning': data.get('Reasoning'),
+    }
+
+
 def parse_response(json_string):
     """
     Parse LLM response JSON into structured format.
@@ -211,47 +311,61 @@ def parse_response(json_string):
     try:
         clean_string = clean_json_string(json_string)
         if not clean_string:
-            return {
-                'Political_Label': None,
-                'Political_Score': None,
-                'Stance_Label': None,
-                'Stance_Score': None,
-                'Reasoning': None,
-            }
-
-        try:
-            data = json.loads(clean_string)
-        except json.JSONDecodeError:
-            # Fallback: Manual extraction using regex
-            data = {}
-            for field in ['Political', 'Stance']:
-                label_match = re.search(fr'"{field}":\s*{{\s*"label":\s*"([^"]+)"', clean_string)
-                score_match = re.search(fr'"{field}":\s*{{\s*"label":[^}}]+,"score":\s*([-]?\d+\.?\d*)', clean_string)
-                data[field] = {
-                    'label': label_match.group(1) if label_match else None,
-                    'score': float(score_match.group(1)) if score_match else None
-                }
-
-            reasoning_match = re.search(r'"Reasoning":\s*"(.*?)"', clean_string, re.DOTALL)
-            data['Reasoning'] = reasoning_match.group(1) if reasoning_match else None
+            return dict.fromkeys(PARSED_FIELDS)
 
+        parsed = decode_response(clean_string)
         # Normalize "Neutral" to "Center" for consistency
-        if data.get('Political', {}).get('label') == "Neutral":
-            data['Political']['label'] = "Center"
-
-        return {
-            'Political_Label': data.get('Political', {}).get('label'),
-            'Political_Score': data.get('Political', {}).get('score'),
-            'Stance_Label': data.get('Stance', {}).get('label'),
-            'Stance_Score': data.get('Stance', {}).get('score'),
-            'Reasoning': data.get('Reasoning'),
-        }
+        if parsed['Political_Label'] == "Neutral":
+            parsed['Political_Label'] = "Center"
+        return parsed
     
     except Exception as e:
         print(f"Error parsing JSON: {e}", json_string)
         return None
 
 
+def parse_responses(responses):
+    """
+    Parse a Series of LLM responses into structured columns.
+    
+    Column-wise counterpart of parse_response. Responses that are already a
+    bare JSON object skip the regex extraction; the rest are extracted with
+    Series.str.extract, trying the same patterns as robust_json_extract.
+    
+    Args:
+        responses (pd.Series): Raw LLM responses
+        
+    Returns:
+        pd.DataFrame: One column per parsed field, indexed like responses
+    """
+    text = responses.astype(str).str.strip()
+    is_json_object = text.str.startswith('{') & text.str.endswith('}')
+
+    extracted = text.where(is_json_object)
+    for pattern in _JSON_PATTERNS:
+        missing = extracted.isna()
+        if not missing.any():
+            break
+        extracted[missing] = text[missing].str.extract(f'({pattern.pattern})', flags=re.DOTALL, expand=False)
+    cleaned = extracted.str.replace(_SPACE_RE, ' ', regex=True)
+
+    records = []
+    for raw_response, clean_string in zip(responses, cleaned):
+        if not isinstance(clean_string, str):
+            records.append({})
+            continue
+        try:
+            records.append(decode_response(clean_string))
+        except Exception as e:
+            print(f"Error parsing JSON: {e}", raw_response)
+            records.append({})
+
+    parsed = pd.DataFrame.from_records(records, index=responses.index, columns=PARSED_FIELDS)
+    # Normalize "Neutral" to "Center" for consistency
+    parsed['Political_Label'] = parsed['Political_Label'].replace("Neutral", "Center")
+    return parsed
+
+
 if __name__ == '__main__':
     claude_model_version_list = [
         'claude-3-5-sonnet-20241022'
@@ -9,10 +9,43 @@ Date: 2024
 """
 
 import anthropic
-import re
 import time
 import json
-import random
+import functools
+import logging
+import hashlib
+
+from common.request_common import (
+    _RE_REASONING, _RE_BIAS, _JSON_DECODER, _get_cached_response, _put_cached_response,
+    TokenBucket, _retry_delay,
+)
+
+
+log = logging.getLogger(__name__)
+
+# Anthropic rate limits shared by every Claude instance in this process; adjust to your API tier
+REQUESTS_PER_MINUTE = 1000
+INPUT_TOKENS_PER_MINUTE = 80000
+
+_rate_limiter = TokenBucket(REQUESTS_PER_MINUTE, INPUT_TOKENS_PER_MINUTE)
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_client(api_key):
+    """
+    Return the Anthropic client shared by every Claude instance.
+    
+    One client per API key keeps a single HTTP connection pool, so calls from
+    different instances and threads reuse keep-alive connections. Retries are
+    handled by Claude.run, so the SDK's own retries are disabled.
+    
+    Args:
+        api_key (str): Anthropic API key
+        
+    Returns:
+        anthropic.Anthropic: Shared API client
+    """
+    return anthropic.Anthropic(api_key=api_key, max_retries=0)
 
 
 class Claude:
@@ -35,6 +68,7 @@ class Claude:
         self.messages = []
         self.max_retries = 3
         self.retry_delay = 5  # seconds
+        self.client = _shared_client(self.API_KEY)
     
     def add_role(self, role):
         """
@@ -45,6 +79,19 @@ class Claude:
         """
         self.role = role
 
+    def reset_role(self, role):
+        """
+        Start a fresh conversation with a new system role.
+        
+        This lets a single client instance be reused across personas and
+        articles without carrying over earlier messages.
+        
+        Args:
+            role (str): The system role prompt to set
+        """
+        self.messages = []
+        self.add_role(role)
+
     def add_message(self, role, content):
         """
         Add a message to the conversation thread.
@@ -55,12 +102,21 @@ class Claude:
         """
         self.messages.append({"role": role, "content": content})
 
+    def estimate_tokens(self):
+        """
+        Roughly estimate the input tokens of the next request.
+        
+        Returns:
+            int: About one token per four characters of role and messages
+        """
+        return (len(self.role) + sum(len(message["content"]) for message in self.messages)) // 4
+
     def check_answer(self, answer):
         """
         Validate and extract JSON response from Claude answer.
         
-        This method uses regex patterns to extract structured JSON responses
-        containing political analysis data.
+        This method decodes the first JSON object containing political analysis
+        data, falling back to regex patterns when the JSON is malformed.
         
         Args:
             answer (str): The raw response from Claude
@@ -68,20 +124,24 @@ class Claude:
         Returns:
             str or None: Extracted JSON string if valid, None otherwise
         """
-        # First attempt: Match JSON that includes "Reasoning"
-        match = re.search(r'({.*"Political":.*?"Reasoning":.*?})', answer, re.DOTALL)
-        
-        if match:
-            json_part = match.group(1)  # Extract the JSON part including "Reasoning"
-        else:
-            # Second attempt: Match JSON that includes up to the second closing brace after "Bias"
-            match = re.search(r'({.*"Political":.*?"Bias":.*?}\s*})', answer, re.DOTALL)
-            if match:
-                json_part = match.group(1)  # Extract the JSON part up to the second closing brace
-            else:
-                json_part = None  # Return None if no match is found
-        
-        return json_part
+        if '"Political"' not in answer:
+            return None
+
+        # First attempt: decode each candidate object directly with the C JSON parser
+        start = answer.find('{')
+        while start != -1:
+            try:
+                obj, end = _JSON_DECODER.raw_decode(answer, start)
+            except ValueError:
+                obj = None
+            if isinstance(obj, dict) and 'Political' in obj and ('Reasoning' in obj or 'Bias' in obj):
+                return answer[start:end]
+            start = answer.find('{', start + 1)
+
+        # Fallback for malformed JSON: JSON that includes "Reasoning"; then JSON
+        # up to the second closing brace after "Bias"
+        match = _RE_REASONING.search(answer) or _RE_BIAS.search(answer)
+        return match.group(1) if match else None
 
     def run(self, prompt):
         """
@@ -98,13 +158,22 @@ class Claude:
         """
         self.add_message("user", prompt)
 
+        # Identical requests (same model, role and conversation) reuse the earlier answer
+        cache_key = hashlib.sha256(json.dumps([self.model, self.role, self.messages]).encode()).hexdigest()
+        cached = _get_cached_response(cache_key)
+        if cached is not None:
+            answer, checked_answer = cached
+            self.add_message("assistant", answer)
+            return checked_answer
+
         for attempt in range(self.max_retries):
             try:
-                self.client = anthropic.Anthropic(api_key=self.API_KEY)
-
+                _rate_limiter.acquire(self.estimate_tokens())
                 completion = self.client.messages.create(
                     model=self.model,
-                    system=self.role,
+                    # The persona role prompt is identical for every article of a query,
+                    # so it is marked for prompt caching
+                    system=[{"type": "text", "text": self.role, "cache_control": {"type": "ephemeral"}}],
                     max_tokens=4096,
                     temperature=0.2,
                     messages=self.messages
@@ -112,13 +181,14 @@ class Claude:
                 
                 answer = completion.content[0].text
                 
-                # Convert the completion object to a dictionary and print it as JSON
-                completion_dict = completion.to_dict()
-                completion_json = json.dumps(completion_dict, indent=4)
-                print(f"Completion in JSON format (Attempt {attempt + 1}):")
+                # Serializing the full completion is only worth it when debugging
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(f"Completion in JSON format (Attempt {attempt + 1}):\n"
+                              f"{json.dumps(completion.to_dict(), indent=4)}")
 
                 checked_answer = self.check_answer(answer)
                 if checked_answer:
+                    _put_cached_response(cache_key, (answer, checked_answer))
                     self.add_message("assistant", answer)
                     return checked_answer
                 else:
@@ -127,7 +197,8 @@ class Claude:
                         time.sleep(self.retry_delay)
             except Exception as e:
                 print(f"Error on attempt {attempt + 1}: {e}")
-                time.sleep(60)
+                if attempt < self.max_retries - 1:
+                    time.sleep(_retry_delay(e, attempt))
 
         print("Max retries reached. Unable to get a valid answer.")
-        return None
\ No newline at end of file
+        return None
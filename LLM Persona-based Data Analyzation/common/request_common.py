@@ -0,0 +1,150 @@
+"""
+Shared API Client Helpers
+
+This module holds the answer extraction patterns, the response cache, the rate
+limiter and the retry backoff used by both the ChatGPT and the Claude client.
+
+Author: Research Team
+Date: 2024
+"""
+
+import re
+import time
+import json
+import random
+import threading
+import collections
+
+
+# Answer extraction patterns, compiled once for every response. The opening
+# brace must directly enclose "Political" and the closing brace is the first
+# one after the last key, so neither end can backtrack across the whole answer.
+_RE_REASONING = re.compile(r'(\{[^{}]*?"Political":.*?"Reasoning":[^}]*\})', re.DOTALL)
+_RE_BIAS = re.compile(r'(\{[^{}]*?"Political":.*?"Bias":[^}]*\}\s*\})', re.DOTALL)
+
+_JSON_DECODER = json.JSONDecoder()
+
+# Maximum number of validated answers kept in _response_cache; the least recently
+# used ones are evicted first
+RESPONSE_CACHE_SIZE = 4096
+
+# Validated answers keyed by a hash of the full request, shared by all clients
+_response_cache = collections.OrderedDict()
+
+# Guards _response_cache from worker threads
+_response_cache_lock = threading.Lock()
+
+
+def _get_cached_response(cache_key):
+    """
+    Look up a cached answer and mark it as recently used.
+    
+    Args:
+        cache_key (str): Hash of the request
+    
+    Returns:
+        tuple or None: (answer, checked_answer) if cached, otherwise None
+    """
+    with _response_cache_lock:
+        cached = _response_cache.get(cache_key)
+        if cached is not None:
+            _response_cache.move_to_end(cache_key)
+        return cached
+
+
+def _put_cached_response(cache_key, response):
+    """
+    Cache an answer, evicting the least recently used one when full.
+    
+    Args:
+        cache_key (str): Hash of the request
+        response (tuple): (answer, checked_answer) to cache
+    """
+    with _response_cache_lock:
+        _response_cache[cache_key] = response
+        _response_cache.move_to_end(cache_key)
+        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+
+class TokenBucket:
+    """
+    Thread-safe request and token budget that refills continuously.
+    
+    Callers reserve one request plus an estimated token count before each API
+    call, so concurrent workers stay under the per-minute limits instead of
+    running into 429 responses.
+    """
+
+    def __init__(self, rpm, tpm):
+        """
+        Initialize a full bucket.
+        
+        Args:
+            rpm (int): Requests allowed per minute
+            tpm (int): Input tokens allowed per minute
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """
+        Take budget for one request if available.
+        
+        Args:
+            tokens (int): Estimated input tokens for the request
+            
+        Returns:
+            float: 0 if the request may proceed, otherwise seconds to wait before retrying
+        """
+        # A single request larger than the whole budget must still be able to go through
+        tokens = min(tokens, self.tpm)
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.updated = now
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+            if self.requests >= 1 and self.tokens >= tokens:
+                self.requests -= 1
+                self.tokens -= tokens
+                return 0
+            return max((1 - self.requests) * 60 / self.rpm, (tokens - self.tokens) * 60 / self.tpm)
+
+    def acquire(self, tokens):
+        """
+        Block until budget for one request is available, then take it.
+        
+        Args:
+            tokens (int): Estimated input tokens for the request
+        """
+        while (wait := self.reserve(tokens)) > 0:
+            time.sleep(wait)
+
+
+def _retry_delay(error, attempt):
+    """
+    Seconds to wait before retrying a failed request.
+    
+    Rate-limit errors honour the server's retry-after header; anything else
+    backs off exponentially with jitter.
+    
+    Args:
+        error (Exception): The exception raised by the request
+        attempt (int): Zero-based attempt number
+        
+    Returns:
+        float: Delay in seconds
+    """
+    if getattr(error, 'status_code', None) == 429:
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            pass
+    return min(2 ** attempt + random.random(), 30)
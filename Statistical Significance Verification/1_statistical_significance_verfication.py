@@ -22,27 +22,125 @@ Date: 2024
 
 import pandas as pd
 import os
-from scipy.stats import kruskal, f_oneway, shapiro, levene
+from scipy.stats import kruskal, f_oneway, shapiro, levene, tukey_hsd
 from statsmodels.stats.multitest import multipletests
-from statsmodels.stats.multicomp import pairwise_tukeyhsd
 import numpy as np
-from datetime import datetime
-import re
 import traceback
 import math
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import pickle
 
 # Set the directory and fetch the dataset files
 current_dir = os.path.dirname(os.path.abspath(__file__))
 # cache_2dim_political_stance_personas
 setting_date = '0921-30'
 datasets_file_path = os.path.join(current_dir, f'../parsing_folder/results_{setting_date}')
-datetime_folders = [folder for folder in os.listdir(datasets_file_path) if os.path.isdir(os.path.join(datasets_file_path, folder))]
 
-# Dictionary to store all statistical test results
-pf_model_comparisons = {}
+
+def walk_pf_folders(root):
+    """
+    Walk the date / search engine / user context folder tree once.
+    
+    Uses os.scandir so each directory is listed with its entry types in a
+    single call instead of a listdir plus one isdir stat per entry.
+    
+    Args:
+        root (str): Path to the parsed results folder
+        
+    Returns:
+        list: (datetime_folder, pir_folder, pf_folder, final_path, csv_files) tuples,
+              where csv_files is the sorted list of CSV file names in final_path
+    """
+    def subfolders(path):
+        return sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+
+    pf_folder_list = []
+    for datetime_folder in subfolders(root):
+        pir_path = os.path.join(root, datetime_folder)
+        for pir_folder in subfolders(pir_path):
+            pf_path = os.path.join(pir_path, pir_folder)
+            for pf_folder in subfolders(pf_path):
+                final_path = os.path.join(pf_path, pf_folder)
+                csv_files = sorted(entry.name for entry in os.scandir(final_path)
+                                   if entry.is_file() and entry.name.endswith('.csv'))
+                pf_folder_list.append((datetime_folder, pir_folder, pf_folder, final_path, csv_files))
+    return pf_folder_list
+
+
+# All statistical test results, as parallel lists of keys and TestRows
+result_keys = []
+result_rows = []
+
+# Suffixes (lowercase) of the per-model score columns read from each result file
+SCORE_COLUMN_SUFFIXES = ('political_score', 'stance_score')
+
+# Largest group size passed to Shapiro-Wilk; bigger groups are subsampled
+SHAPIRO_MAX_N = 5000
+
+# Shapiro-Wilk p-values by group content (raw float64 bytes), reused when the same
+# group recurs within a worker; cleared once it holds SHAPIRO_CACHE_SIZE groups
+SHAPIRO_CACHE_SIZE = 4096
+_shapiro_cache = {}
+
+# Result of the tests of one key; the defaults describe a key that could not be tested.
+# Instances are pickled by worker processes and the result cache, so the module is
+# pinned to __main__ where both the parent and spawned workers can resolve it.
+TestRow = collections.namedtuple(
+    'TestRow',
+    ['pf_values', 'test', 'stat', 'p_value', 'normality_passed', 'homogeneity_passed', 'tukey_n_sig', 'tukey_min_p',
+     'effect_size', 'effect_size_type', 'effect_size_secondary', 'effect_size_secondary_type', 'effect_interpretation'],
+    defaults=['None', 0.0, 1.0, False, False, 0, 1.0, 0.0, 'None', 0.0, 'None', 'negligible'],
+    module='__main__'
+)
+
+# Dtypes of the test and correction fields in the results table
+RESULT_DTYPES = {
+    'test': object,
+    'stat': np.float64,
+    'p_value': np.float64,
+    'bonferroni_p_value': np.float64,
+    'bh_adjusted_p_value': np.float64,
+    'bonferroni_significant': bool,
+    'bh_significant': bool,
+    'correction_group': object,
+    'group_size': np.int64,
+    'effect_size': np.float64,
+    'effect_size_type': object,
+    'effect_size_secondary': np.float64,
+    'effect_size_secondary_type': object,
+    'effect_interpretation': object,
+    'normality_passed': bool,
+    'homogeneity_passed': bool,
+    'tukey_n_sig': np.int64,
+    'tukey_min_p': np.float64
+}
+
+# Column order of the results table
+RESULT_COLUMNS = [
+    'datetime_folder', 'pir_folder', 'pf_folder', 'query', 'model_name', 'directness',
+    'pf_values', 'test', 'stat', 'p_value', 'bonferroni_p_value', 'bh_adjusted_p_value',
+    'original_significant', 'bonferroni_significant', 'bh_significant', 'correction_group',
+    'group_size', 'effect_size', 'effect_size_type', 'effect_size_secondary',
+    'effect_size_secondary_type', 'effect_interpretation', 'normality_passed',
+    'homogeneity_passed', 'tukey_n_sig', 'tukey_min_p'
+]
+
+# Low-cardinality string columns stored as categoricals (dictionary-encoded in Parquet)
+CATEGORICAL_COLUMNS = [
+    'pir_folder', 'pf_folder', 'query', 'model_name', 'directness', 'test', 'correction_group',
+    'effect_size_type', 'effect_size_secondary_type', 'effect_interpretation'
+]
+
+# Results are saved as Parquet; set to True to also write the legacy tests_<date>.csv
+WRITE_CSV = False
+
+# Per-folder test results are cached here and reused while the folder's CSVs and this script are unchanged
+cache_dir = os.path.join(current_dir, f'4/cache_{setting_date}')
 
 # 1. First, calculate the number of unique URLs for each group
-def calculate_unique_url_counts():
+def calculate_unique_url_counts(pf_folder_list):
     """
     Calculate the number of unique URLs for each user context group.
     
@@ -50,67 +148,42 @@ def calculate_unique_url_counts():
     extracts unique URL counts for each combination of date, search engine (PIR), 
     user context (PF), and query, and returns a consolidated dataframe.
     
+    Args:
+        pf_folder_list (list): Folder tuples from walk_pf_folders
+    
     Returns:
         pd.DataFrame: DataFrame containing unique URL counts with columns:
                      ['datetime_folder', 'pir_folder', 'pf_folder', 'query', 'Unique_URL_Count']
     """
-    # Create a list to store all dataframes
-    all_dfs = []
+    # Unique URLs per (datetime_folder, pir_folder, pf_folder, query); several
+    # files (user context details) of the same query share one set
+    url_sets = {}
 
     # Process datasets
-    for datetime_folder in datetime_folders:
-        folder_date = datetime.strptime(datetime_folder, "%Y-%m-%d")
-        pir_folders = [folder for folder in os.listdir(os.path.join(datasets_file_path, datetime_folder))]
-        pir_path = os.path.join(datasets_file_path, datetime_folder)
-
-        for pir_folder in pir_folders:
-            pf_folders = [folder for folder in os.listdir(os.path.join(pir_path, pir_folder))]
-            pf_path = os.path.join(datasets_file_path, datetime_folder, pir_folder)
-
-            for pf_folder in pf_folders:
-                csv_files = [file for file in os.listdir(os.path.join(pf_path, pf_folder)) if file.endswith('.csv')]
-                csv_files = sorted(csv_files)
-                final_path = os.path.join(pf_path, pf_folder)
-
-                for file in csv_files:
-                    try:
-                        df = pd.read_csv(os.path.join(final_path, file), encoding='utf-8')[:30]
-                        
-                        # Add metadata columns
-                        df['query'] = file.split('_')[0].lower()
-                        df['pf_folder_Details'] = '_'.join(file.replace('.csv', '').split('_')[1:])
-                        df['datetime_folder'] = datetime_folder
-                        df['pir_folder'] = pir_folder
-                        df['pf_folder'] = pf_folder
-                        
-                        all_dfs.append(df)
-                    except Exception as e:
-                        print(f"Error processing file {file}: {e}")
-                        continue
-
-    # Combine all dataframes
-    if all_dfs:
-        combined_df = pd.concat(all_dfs, ignore_index=True)
-        
-        # Calculate unique URL counts by group
-        unique_counts = combined_df.groupby(['datetime_folder', 'pir_folder', 'pf_folder', 'query'])['url'].nunique().reset_index()
-        unique_counts.rename(columns={'url': 'Unique_URL_Count'}, inplace=True)
-        
-        return unique_counts
+    for datetime_folder, pir_folder, pf_folder, final_path, csv_files in pf_folder_list:
+        for file in csv_files:
+            try:
+                # Only the first 30 URLs of each result file are counted
+                df = pd.read_csv(os.path.join(final_path, file), encoding='utf-8',
+                                 nrows=30, usecols=lambda col: col == 'url')
+            except Exception as e:
+                print(f"Error processing file {file}: {e}")
+                continue
+
+            query = file.split('_')[0].lower()
+            urls = url_sets.setdefault((datetime_folder, pir_folder, pf_folder, query), set())
+            if 'url' in df.columns:
+                urls.update(df['url'].dropna())
+
+    if url_sets:
+        return pd.DataFrame.from_records(
+            [(*group, len(urls)) for group, urls in sorted(url_sets.items())],
+            columns=['datetime_folder', 'pir_folder', 'pf_folder', 'query', 'Unique_URL_Count']
+        )
     else:
         print("No valid data found in any CSV files.")
         return pd.DataFrame(columns=['datetime_folder', 'pir_folder', 'pf_folder', 'query', 'Unique_URL_Count'])
 
-
-# Calculate and store unique URL counts
-unique_url_counts_df = calculate_unique_url_counts()
-
-# Save if needed
-if not os.path.exists(os.path.join(current_dir, f'4/aggregated_results')):
-    os.makedirs(os.path.join(current_dir, f'4/aggregated_results'))
-unique_url_counts_df.to_csv(os.path.join(current_dir, f'4/aggregated_results/aggregated_results.csv'), index=False)
-
-
 def calculate_kruskal_effect_size(stat, n_total, n_groups):
     """
     Calculate the effect size (η² or ε²) of the Kruskal-Wallis test.
@@ -156,15 +229,19 @@ def calculate_kruskal_effect_size(stat, n_total, n_groups):
     return eta_squared, epsilon_squared, interpretation
 
 
-def calculate_anova_effect_size(groups):
+def calculate_anova_effect_size(stat, n_total, n_groups):
     """
     Calculate the effect size (η² and ω²) of the ANOVA test.
     
     This function computes both eta-squared and omega-squared effect sizes
     for ANOVA F-test, providing standardized measures of effect magnitude.
+    Both are derived in closed form from the F statistic and the degrees of
+    freedom, so the data does not need another pass.
     
     Args:
-        groups (list): List of data groups (each group is a list/array of values)
+        stat (float): ANOVA F statistic
+        n_total (int): Total sample size across all groups
+        n_groups (int): Number of groups being compared
     
     Returns:
         tuple: A tuple containing:
@@ -173,52 +250,24 @@ def calculate_anova_effect_size(groups):
             - interpretation (str): Interpretation of the effect size
     """
     try:
-        # Merge all data
-        all_data = np.concatenate(groups)
-        n_total = len(all_data)
-        
         # Degrees of freedom between groups
-        df_between = len(groups) - 1
+        df_between = n_groups - 1
         
         # Degrees of freedom within groups
-        df_within = n_total - len(groups)
+        df_within = n_total - n_groups
         
-        if df_within <= 0 or df_between <= 0:
+        # F is NaN when every value is identical (no variance to explain)
+        if df_within <= 0 or df_between <= 0 or math.isnan(stat):
             return 0.0, 0.0, "negligible"
         
-        # Grand mean
-        grand_mean = np.mean(all_data)
-        
-        # Group means
-        group_means = [np.mean(group) for group in groups]
-        
-        # Group sizes
-        group_sizes = [len(group) for group in groups]
-        
-        # Between-group sum of squares (SSB)
-        ss_between = sum(size * (mean - grand_mean)**2 for size, mean in zip(group_sizes, group_means))
-        
-        # Total sum of squares (SST)
-        ss_total = sum((x - grand_mean)**2 for x in all_data)
-        
-        # Within-group sum of squares (SSW)
-        ss_within = ss_total - ss_between
-        
-        # Calculate eta squared (η²)
-        if ss_total == 0:
-            eta_squared = 0.0
-        else:
-            eta_squared = ss_between / ss_total
-
-        # Calculate omega squared (ω²)
-        ms_within = ss_within / df_within
-        
-        # Check the denominator of omega squared
-        denominator = ss_total + ms_within
-        if denominator <= 0:  # If denominator is 0 or negative
-            omega_squared = 0
+        if math.isinf(stat):
+            # No within-group variance: the groups explain all of the variance
+            eta_squared = 1.0
+            omega_squared = 1.0
         else:
-            omega_squared = (ss_between - (df_between * ms_within)) / denominator
+            # η² = SSB / SST and ω² = (SSB - df_between * MSW) / (SST + MSW), with F = MSB / MSW
+            eta_squared = (stat * df_between) / (stat * df_between + df_within)
+            omega_squared = (stat - 1) * df_between / (stat * df_between + df_within + 1)
         
         # Interpretation information
         interpretation = ""
@@ -237,20 +286,23 @@ def calculate_anova_effect_size(groups):
     return eta_squared, omega_squared, interpretation
 
 
-def apply_corrections(test_results):
+def apply_corrections(pir_folders, pf_folders, model_names, p_values):
     """
     Apply multiple comparison corrections to statistical test results.
     
-    Groups test results by search engine and query, then applies both 
+    Groups test results by search engine, user context and model, then applies both 
     Benjamini-Hochberg (FDR) and Bonferroni corrections to control for 
     multiple testing. This is essential when conducting multiple statistical 
     tests simultaneously to avoid inflated Type I error rates.
     
     Args:
-        test_results (dict): Dictionary containing test results with p-values
+        pir_folders (np.ndarray): Search engine of each test result
+        pf_folders (np.ndarray): User context of each test result
+        model_names (np.ndarray): Score model of each test result
+        p_values (np.ndarray): p-value of each test result
         
     Returns:
-        dict: Updated test results with correction information including:
+        dict: Arrays aligned with the inputs:
               - bonferroni_p_value: Bonferroni-adjusted p-value
               - bh_adjusted_p_value: Benjamini-Hochberg adjusted p-value  
               - bonferroni_significant: Boolean significance under Bonferroni
@@ -258,82 +310,49 @@ def apply_corrections(test_results):
               - correction_group: Group identifier for correction
               - group_size: Number of tests in the correction group
     """
-    # Check that all keys have required fields
-    for key, info in list(test_results.items()):
-        missing_keys = []
-        for expected_key in ['p_value']:
-            if expected_key not in info:
-                missing_keys.append(expected_key)
-        
-        if missing_keys:
-            print(f"Missing keys {missing_keys} in test result for {key}. Adding default values.")
-            for missing_key in missing_keys:
-                test_results[key][missing_key] = 1.0  # Set default value to 1.0 (most conservative p-value)
-    
-    # Group by search engine (pir_folder) and query
-    grouped_tests = {}
-    for key, info in test_results.items():
-        search_engine = key[1]
-        context = key[2]
-        model_name = key[4]
-        
-        group_key = (search_engine, context, model_name)
-            
-        if group_key not in grouped_tests:
-            grouped_tests[group_key] = []
-        
-        # If p_value is NaN, replace with 1.0 (most conservative p-value)
-        p_value = info.get('p_value', 1.0)
-        if np.isnan(p_value):
-            p_value = 1.0
-            test_results[key]['p_value'] = p_value
-        
-        grouped_tests[group_key].append((key, p_value))
+    # If p_value is NaN, replace with 1.0 (most conservative p-value)
+    p_values = np.where(np.isnan(p_values), 1.0, p_values)
     
-    # Apply corrections for each group
-    for group_key, tests in grouped_tests.items():
-        keys = [t[0] for t in tests]
-        p_values = [t[1] for t in tests]
-        
-        # Check for NaN values
-        if any(np.isnan(p) for p in p_values):
-            print(f"Warning: NaN p-values found in group {group_key}. Replacing with 1.0")
-            p_values = [p if not np.isnan(p) else 1.0 for p in p_values]
-        
-        # Bonferroni correction
-        n_tests = len(p_values)
-        bonferroni_alpha = 0.05 / n_tests
-        bonferroni_adjusted = [min(p * n_tests, 1.0) for p in p_values]
-        
+    # Group by search engine (pir_folder), context and model
+    group_ids, group_keys = pd.MultiIndex.from_arrays([pir_folders, pf_folders, model_names]).factorize()
+    group_sizes = np.bincount(group_ids, minlength=len(group_keys))
+    n_tests = group_sizes[group_ids]
+    
+    # Bonferroni correction for all groups at once
+    bonferroni_adjusted = np.minimum(p_values * n_tests, 1.0)
+    bonferroni_significant = p_values < 0.05 / n_tests
+    
+    # Benjamini-Hochberg correction, one multipletests call per group
+    bh_adjusted_p_values = np.empty_like(p_values)
+    order = np.argsort(group_ids, kind='stable')
+    for group_id, indices in enumerate(np.split(order, np.cumsum(group_sizes)[:-1])):
         try:
-            # Benjamini-Hochberg correction
-            _, bh_adjusted_p_values, _, _ = multipletests(
-                p_values,
+            _, bh_adjusted_p_values[indices], _, _ = multipletests(
+                p_values[indices],
                 alpha=0.05,
                 method='fdr_bh'
             )
         except Exception as e:
-            print(f"Error applying BH correction for group {group_key}: {e}")
-            bh_adjusted_p_values = [min(p * 2, 1.0) for p in p_values]  # Conservative replacement value
-        
-        # Add the results of both correction methods to the original results
-        for i, key in enumerate(keys):
-            test_results[key]['bonferroni_p_value'] = bonferroni_adjusted[i]
-            test_results[key]['bh_adjusted_p_value'] = bh_adjusted_p_values[i]
-            test_results[key]['bonferroni_significant'] = p_values[i] < bonferroni_alpha
-            test_results[key]['bh_significant'] = bh_adjusted_p_values[i] < 0.05
-            # Add group information
-            test_results[key]['correction_group'] = f"{group_key[0]}_{group_key[1]}"
-            test_results[key]['group_size'] = n_tests
-    
-    return test_results
+            print(f"Error applying BH correction for group {group_keys[group_id]}: {e}")
+            bh_adjusted_p_values[indices] = np.minimum(p_values[indices] * 2, 1.0)  # Conservative replacement value
+    
+    # Add group information
+    group_names = np.array([f"{group_key[0]}_{group_key[1]}" for group_key in group_keys], dtype=object)
+    return {
+        'bonferroni_p_value': bonferroni_adjusted,
+        'bh_adjusted_p_value': bh_adjusted_p_values,
+        'bonferroni_significant': bonferroni_significant,
+        'bh_significant': bh_adjusted_p_values < 0.05,
+        'correction_group': group_names[group_ids],
+        'group_size': n_tests
+    }
 
 def normalize_data_length(scores_by_pf):
     """
     Normalize data length across user context groups for statistical testing.
     
     This function ensures that all user context groups have comparable sample sizes
-    by either padding shorter groups or truncating longer groups. This is important
+    by truncating longer groups to the length of the shortest one. This is important
     for statistical power and fair comparison across contexts.
     
     Args:
@@ -341,35 +360,64 @@ def normalize_data_length(scores_by_pf):
                             e.g., {'region1': [score1, score2, ...], 'region2': [...]}
         
     Returns:
-        list: List of score arrays, one for each user context group
+        dict: Dictionary mapping each kept user context to a float64 array of its
+              scores; the arrays are views truncated to a common length
         
     Note:
         Groups with insufficient data (< 2 observations) are excluded from analysis
         to ensure meaningful statistical testing.
     """
-    if not scores_by_pf:
-        return []
-    
-    scores_list = []
-    min_length = float('inf')
-    
-    # Filter out groups with insufficient data and find minimum length
-    valid_groups = {}
-    for pf, scores in scores_by_pf.items():
-        if len(scores) >= 2:  # Minimum required for statistical testing
-            valid_groups[pf] = scores
-            min_length = min(min_length, len(scores))
+    # Filter out groups with insufficient data (minimum required for statistical testing)
+    valid_groups = {pf: np.asarray(scores, dtype=np.float64)
+                    for pf, scores in scores_by_pf.items() if len(scores) >= 2}
+    if not valid_groups:
+        return {}
     
-    if not valid_groups or min_length < 2:
-        return []
+    # Truncate all groups to the minimum length; slicing returns views, not copies
+    min_length = min(scores.size for scores in valid_groups.values())
+    return {pf: scores[:min_length] for pf, scores in valid_groups.items()}
+
+def check_normality(scores_list, alpha=0.05):
+    """
+    Check whether every group passes the Shapiro-Wilk normality test.
     
-    # Normalize all groups to have the same length
-    for pf, scores in valid_groups.items():
-        if len(scores) >= min_length:
-            normalized_scores = scores[:min_length]  # Truncate to minimum length
-            scores_list.append(normalized_scores)
+    Groups already tested are looked up in _shapiro_cache by their content.
+    The rest are tested in one batched call: they are stacked into a
+    NaN-padded (n_groups, max_len) array and tested along axis 1. Groups
+    larger than SHAPIRO_MAX_N are tested on a fixed-seed random subsample,
+    since Shapiro-Wilk p-values are unreliable above that size and the test
+    cost grows with n.
     
-    return scores_list
+    Args:
+        scores_list (list): List of score arrays
+        alpha (float): Significance level of the normality test
+        
+    Returns:
+        bool: True if every group has a p-value of at least alpha
+    """
+    rng = np.random.default_rng(0)
+    samples = []
+    for scores in scores_list:
+        if len(scores) > SHAPIRO_MAX_N:
+            scores = rng.choice(scores, SHAPIRO_MAX_N, replace=False)
+        samples.append(np.ascontiguousarray(scores, dtype=np.float64))
+    sample_keys = [sample.tobytes() for sample in samples]
+
+    p_by_key = {key: _shapiro_cache[key] for key in sample_keys if key in _shapiro_cache}
+    untested = {key: sample for key, sample in zip(sample_keys, samples) if key not in p_by_key}
+    if untested:
+        max_len = max(len(sample) for sample in untested.values())
+        stacked = np.full((len(untested), max_len), np.nan)
+        for i, sample in enumerate(untested.values()):
+            stacked[i, :len(sample)] = sample
+        p_values = shapiro(stacked, axis=1, nan_policy='omit')[1].tolist()
+        p_by_key.update(zip(untested, p_values))
+        if len(_shapiro_cache) + len(untested) > SHAPIRO_CACHE_SIZE:
+            _shapiro_cache.clear()
+        _shapiro_cache.update(zip(untested, p_values))
+
+    # A NaN p-value (group too small to test) fails the check, as p >= alpha is False
+    return all(p_by_key[key] >= alpha for key in sample_keys)
 
 def ensure_numeric(scores_list):
     """
@@ -383,513 +431,417 @@ def ensure_numeric(scores_list):
     """
     cleaned_scores = []
     for scores in scores_list:
-        # Convert to numpy array if not already
-        scores_array = np.array(scores, dtype=float)
+        # No copy when the scores are already a float64 array
+        scores_array = np.asarray(scores, dtype=np.float64)
         
-        # Remove NaN values
+        # Remove NaN values; only include if we have valid data after cleaning
         valid_scores = scores_array[~np.isnan(scores_array)]
-        
-        # Only include if we have valid data after cleaning
-        if len(valid_scores) > 0:
+        if valid_scores.size:
             cleaned_scores.append(valid_scores)
-            # print(f"Original length: {len(scores_array)}, After NaN removal: {len(valid_scores)}")
         else:
             print(f"Warning: All values were NaN in one of the score arrays")
     
     return cleaned_scores
 
-for datetime_folder in datetime_folders:
-    folder_date = datetime.strptime(datetime_folder, "%Y-%m-%d")
-    pir_folders = [folder for folder in os.listdir(os.path.join(datasets_file_path, datetime_folder))]
-    pir_path = os.path.join(datasets_file_path, datetime_folder)
+def get_cache_path(datetime_folder, pir_folder, pf_folder, final_path, csv_files):
+    """
+    Build the cache file path for one user context folder's test results.
+    
+    The name embeds a signature of the modification time and size of every
+    CSV in the folder and of this script, so any change to the inputs or the
+    analysis code points at a new cache file.
+    
+    Args:
+        datetime_folder (str): Collection date folder
+        pir_folder (str): Search engine folder
+        pf_folder (str): User context folder
+        final_path (str): Path to the folder
+        csv_files (list): CSV file names in the folder
+        
+    Returns:
+        str: Path to the pickle file for this folder
+    """
+    digest = hashlib.sha1()
+    for path in [os.path.abspath(__file__)] + [os.path.join(final_path, file) for file in csv_files]:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    return os.path.join(cache_dir, f"{datetime_folder}_{pir_folder}_{pf_folder}_{digest.hexdigest()}.pkl")
+
+def write_cache_file(cache_path, comparisons):
+    """
+    Store one folder's test results and drop its outdated cache files.
+    
+    The pickle is written to a temporary file and moved into place, so an
+    interrupted run never leaves a truncated cache file behind. Older files
+    of the same folder, whose signatures no longer match, are then removed.
+    
+    Args:
+        cache_path (str): Path returned by get_cache_path
+        comparisons (dict): Test rows of the folder keyed by comparison key
+    """
+    partial_path = cache_path + '.partial'
+    with open(partial_path, 'wb') as f:
+        pickle.dump(comparisons, f)
+    os.replace(partial_path, cache_path)
+
+    cache_name = os.path.basename(cache_path)
+    prefix = cache_name[:cache_name.rindex('_') + 1]
+    for name in os.listdir(cache_dir):
+        signature = name[len(prefix):-len('.pkl')]
+        if (name != cache_name and name.startswith(prefix) and name.endswith('.pkl')
+                and len(signature) == 40 and all(c in '0123456789abcdef' for c in signature)):
+            os.remove(os.path.join(cache_dir, name))
 
-    for pir_folder in pir_folders:
-        pf_folders = [folder for folder in os.listdir(os.path.join(pir_path, pir_folder))]
-        pf_path = os.path.join(datasets_file_path, datetime_folder, pir_folder)
 
-        for pf_folder in pf_folders:
-            csv_files = [file for file in os.listdir(os.path.join(pf_path, pf_folder)) if file.endswith('.csv')]
-            csv_files = sorted(csv_files)
-            final_path = os.path.join(pf_path, pf_folder)
+def run_tests(key, scores_list, pf_values):
+    """
+    Compare the score groups of one (folder, query, model) key.
+    
+    Chooses ANOVA when every group passes the normality and homogeneity
+    checks and Kruskal-Wallis otherwise, then adds the post-hoc test and the
+    effect sizes. Keys are independent of each other, so this is a pure
+    function of its arguments.
+    
+    Args:
+        key (tuple): (datetime_folder, pir_folder, pf_folder, query, model_name, directness)
+        scores_list (list): Cleaned score arrays (or sequences), one per user context (at least two)
+        pf_values (list): User contexts of the groups
+        
+    Returns:
+        tuple: (key, TestRow)
+    """
+    datetime_folder, pir_folder, pf_folder, query, model_name, _ = key
+    # Every SciPy call below then takes the groups as they are, without converting them again
+    scores_list = [np.ascontiguousarray(scores, dtype=np.float64) for scores in scores_list]
+    try:
+        # Groups too small for Shapiro-Wilk or with constant values make the assumption
+        # tests degenerate (warnings, NaN); skip them and use Kruskal-Wallis directly
+        if any(len(scores) < 3 or np.ptp(scores) == 0.0 for scores in scores_list):
+            normality_passed = False
+            homogeneity_passed = False
+        else:
+            normality_passed = check_normality(scores_list)
+            homogeneity_passed = levene(*scores_list)[1] >= 0.05
+
+        # 전체 샘플 수 계산
+        n_total = sum(len(scores) for scores in scores_list)
+        n_groups = len(scores_list)
+
+        if normality_passed and homogeneity_passed:
+            try:
+                stat, p_value = f_oneway(*scores_list)
+                # ANOVA effect size 계산 (from the raw F, before NaN handling)
+                eta_squared, omega_squared, effect_interpretation = calculate_anova_effect_size(stat, n_total, n_groups)
+                # check and handle NaN values
+                if math.isnan(stat) or math.isnan(p_value):
+                    print(f"Warning: NaN result in ANOVA for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name}")
+                    stat = 0.0
+                    p_value = 1.0  # most conservative value
+                
+                test_name = 'ANOVA'
+                # Post-hoc Tukey's HSD only when ANOVA rejects H0; keep just the number
+                # of significant pairs and the smallest pairwise p-value
+                tukey_n_sig, tukey_min_p = 0, 1.0
+                if p_value < 0.05:
+                    try:
+                        # p-values of each group pair (upper triangle of the pairwise matrix)
+                        tukey_p_values = tukey_hsd(*scores_list).pvalue[np.triu_indices(n_groups, 1)]
+                        tukey_n_sig, tukey_min_p = int((tukey_p_values < 0.05).sum()), float(tukey_p_values.min())
+                    except Exception as e:
+                        print(f"Error in Tukey test: {e}")
+                
+                effect_size = eta_squared
+                effect_size_type = 'Eta Squared'
+                effect_size_secondary = omega_squared
+                effect_size_secondary_type = 'Omega Squared'
+            except Exception as e:
+                print(f"Error in ANOVA: {e}")
+                stat = 0.0
+                p_value = 1.0  # most conservative value
+                test_name = 'ANOVA (Error)'
+                tukey_n_sig, tukey_min_p = 0, 1.0
+                effect_size = 0.0
+                effect_size_type = 'Eta Squared'
+                effect_size_secondary = 0.0
+                effect_size_secondary_type = 'Omega Squared'
+                effect_interpretation = 'negligible'
+        else:
+            try:
+                stat, p_value = kruskal(*scores_list)
+                # check and handle NaN values
+                if math.isnan(stat) or math.isnan(p_value):
+                    print(f"Warning: NaN result in Kruskal-Wallis for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name}")
+                    stat = 0.0
+                    p_value = 1.0  # most conservative value
+                
+                test_name = 'Kruskal-Wallis'
+                tukey_n_sig, tukey_min_p = 0, 1.0
+                
+                # Kruskal-Wallis effect size 계산
+                eta_squared, epsilon_squared, effect_interpretation = calculate_kruskal_effect_size(stat, n_total, n_groups)
+                effect_size = eta_squared
+                effect_size_type = 'Eta Squared'
+                effect_size_secondary = epsilon_squared
+                effect_size_secondary_type = 'Epsilon Squared'
+            except Exception as e:
+                print(f"Error in Kruskal-Wallis: {e}")
+                stat = 0.0
+                p_value = 1.0  # most conservative value
+                test_name = 'Kruskal-Wallis (Error)'
+                tukey_n_sig, tukey_min_p = 0, 1.0
+                effect_size = 0.0
+                effect_size_type = 'Eta Squared'
+                effect_size_secondary = 0.0
+                effect_size_secondary_type = 'Epsilon Squared'
+                effect_interpretation = 'negligible'
+    except Exception as e:
+        print(f"Error during statistical tests: {e}")
+        # set default values on error
+        normality_passed = False
+        homogeneity_passed = False
+        stat = 0.0
+        p_value = 1.0
+        test_name = 'Error'
+        tukey_n_sig, tukey_min_p = 0, 1.0
+        effect_size = 0.0
+        effect_size_type = 'None'
+        effect_size_secondary = 0.0
+        effect_size_secondary_type = 'None'
+        effect_interpretation = 'negligible'
+
+    return key, TestRow(
+        pf_values, test_name, stat, p_value, normality_passed, homogeneity_passed, tukey_n_sig, tukey_min_p,
+        effect_size, effect_size_type, effect_size_secondary, effect_size_secondary_type, effect_interpretation
+    )
+
+
+def process_pf_folder(datetime_folder, pir_folder, pf_folder, final_path, csv_files):
+    """
+    Run the statistical tests for one user context folder.
+    
+    Collects the Political and Stance scores of every query and context
+    detail in the folder, then compares the context groups of each query.
+    Folders are independent, so this runs in a worker process.
+    
+    Args:
+        datetime_folder (str): Collection date folder
+        pir_folder (str): Search engine folder
+        pf_folder (str): User context folder
+        final_path (str): Path to the folder
+        csv_files (list): CSV file names in the folder
+        
+    Returns:
+        dict: TestRow results keyed by
+              (datetime_folder, pir_folder, pf_folder, query, model_name, directness)
+    """
+    comparisons = {}
 
-            model_scores = {model_name: {} for model_name in ['Political_Score', 'Stance_Score']}
+    model_scores = {model_name: {} for model_name in ['Political_Score', 'Stance_Score']}
 
-            for file in csv_files:
+    for file in csv_files:
+        try:
+            # Read only the first 30 rows and the score columns (url keeps the row count)
+            df = pd.read_csv(os.path.join(final_path, file), encoding='utf-8', nrows=30,
+                             usecols=lambda col: col == 'url' or col.lower().endswith(SCORE_COLUMN_SUFFIXES))
+        except:
+            continue  # Handling file read errors
+
+        file_name = file.replace('.csv', '')
+        query = file_name.split('_')[0]
+        # 쿼리문 소문자로 통일  
+        query = query.lower()
+        pf = tuple(file_name.split('_')[1:])
+
+        # Score columns are matched case-insensitively by suffix
+        lower_columns = df.columns.str.lower()
+        for model_name in model_scores:
+            cols_to_read = df.columns[lower_columns.str.endswith(model_name.lower())]
+            # print(f"Reading {model_name} for {datetime_folder}, {pir_folder}, {pf_folder}, {query}")
+            # print(f"cols_to_read: {cols_to_read}")
+            # print(df[cols_to_read].head())
+            df_model = df[cols_to_read].mean(axis=1).values
+            # print(f"df_model: {df_model}")
+            if query not in model_scores[model_name]:
+                model_scores[model_name][query] = {}
+            if pf not in model_scores[model_name][query]:
+                model_scores[model_name][query][pf] = []
+
+            model_scores[model_name][query][pf].extend(df_model)
+
+    # Perform statistical tests depending on the folder and conditions
+    for model_name, queries in model_scores.items():
+        for query, scores_by_pf in queries.items():
+            scores_by_pf = normalize_data_length(scores_by_pf)
+            if pf_folder == 'search_history':
+                # Only the direct search history contexts are compared
+                groups = [('direct', [pf for pf in scores_by_pf if pf[0] == 'direct'])]
+            else:
+                groups = [('all', list(scores_by_pf))]
+
+            for directness, pf_values in groups:
+                scores_list = ensure_numeric([scores_by_pf[pf] for pf in pf_values])
+                key = (datetime_folder, pir_folder, pf_folder, query, model_name, directness)
+                if len(scores_list) == 0:
+                    print(f"No data for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name} {pf_values}")
+                elif len(scores_list) == 1:
+                    print(f"Only one group for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name}. Cannot perform statistical test.")
+                    # set default values when statistical tests cannot be performed
+                    comparisons[key] = TestRow(pf_values)
+                else:
+                    key, comparisons[key] = run_tests(key, scores_list, pf_values)
+
+    return comparisons
+
+
+if __name__ == '__main__':
+    # The folder tree is walked once and shared by the URL counts and the test loop
+    pf_folder_list = walk_pf_folders(datasets_file_path)
+
+    # Calculate and store unique URL counts
+    unique_url_counts_df = calculate_unique_url_counts(pf_folder_list)
+
+    # Save if needed
+    if not os.path.exists(os.path.join(current_dir, f'4/aggregated_results')):
+        os.makedirs(os.path.join(current_dir, f'4/aggregated_results'))
+    unique_url_counts_df.to_csv(os.path.join(current_dir, f'4/aggregated_results/aggregated_results.csv'), index=False)
+
+    # Each user context folder is tested independently in a worker process,
+    # unless its results are cached from an earlier run on the same inputs
+    os.makedirs(cache_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        pending = []
+        for pf_entry in pf_folder_list:
+            cache_path = get_cache_path(*pf_entry)
+            comparisons = None
+            if os.path.exists(cache_path):
                 try:
-                    df = pd.read_csv(os.path.join(final_path, file), encoding='utf-8')[:30]
-                except:
-                    continue  # Handling file read errors
-
-                file_name = file.replace('.csv', '')
-                query = file_name.split('_')[0]
-                # 쿼리문 소문자로 통일  
-                query = query.lower()
-                pf = tuple(file_name.split('_')[1:])
-
-                for model_name in model_scores:
-                    pattern = re.compile(f'{model_name}$', re.IGNORECASE)
-                    cols_to_read = [col for col in df.columns if pattern.search(col)]
-                    # print(f"Reading {model_name} for {datetime_folder}, {pir_folder}, {pf_folder}, {query}")
-                    # print(f"cols_to_read: {cols_to_read}")
-                    # print(df[cols_to_read].head())
-                    df_model = df[cols_to_read].mean(axis=1).values
-                    # print(f"df_model: {df_model}")
-                    if query not in model_scores[model_name]:
-                        model_scores[model_name][query] = {}
-                    if pf not in model_scores[model_name][query]:
-                        model_scores[model_name][query][pf] = []
-
-                    model_scores[model_name][query][pf].extend(df_model)
-
-            # Perform statistical tests depending on the folder and conditions
-            for model_name, queries in model_scores.items():
-                for query, scores_by_pf in queries.items():
-                    scores_by_pf = normalize_data_length(scores_by_pf)
-                    num_comparisons = len(scores_by_pf) * (len(scores_by_pf) - 1) / 2  # Calculate the number of comparisons
-                    if pf_folder == 'search_history':
-                        for directness in ['direct']:
-                            pf_values = [pf for pf in scores_by_pf.keys() if pf[0] == directness]
-                            scores_list = [scores_by_pf[pf] for pf in pf_values]
-                            scores_list = ensure_numeric(scores_list)
-                            # print(f"Performing tests for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name}, {pf_values}")
-                            # print(f"scores_list: {len(scores_list)}")
-                            # print("shape scores_list", [scores.shape for scores in scores_list])
-                            # print('scores_list', scores_list)
-                            num_comparisons = len(scores_list) * (len(scores_list) - 1) / 2
-                            # print(f"num_comparisons: {num_comparisons}")
-                            if len(scores_list) == 0:
-                                print(f"No data for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name} {pf_values}")
-                            elif len(scores_list) == 1:
-                                print(f"Only one group for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name}. Cannot perform statistical test.")
-                                # set default values when statistical tests cannot be performed
-                                key = (datetime_folder, pir_folder, pf_folder, query, model_name, directness)
-                                pf_model_comparisons[key] = {
-                                    'pf_values': pf_values,
-                                    'test': 'None',
-                                    'stat': 0.0,
-                                    'p_value': 1.0,
-                                    'normality_passed': False,
-                                    'homogeneity_passed': False,
-                                    'tukey_results': None,
-                                    'effect_size': 0.0,
-                                    'effect_size_type': 'None',
-                                    'effect_size_secondary': 0.0,
-                                    'effect_size_secondary_type': 'None',
-                                    'effect_interpretation': 'negligible'
-                                }
-                            elif len(scores_list) > 1:
-                                try:
-                                    normality_passed = all(shapiro(scores)[1] >= 0.05 for scores in scores_list)
-                                    homogeneity_passed = levene(*scores_list)[1] >= 0.05
-
-                                    # 전체 샘플 수 계산
-                                    n_total = sum(len(group) for group in scores_list)
-                                    # print(f"n_total: {n_total}")
-                                    n_groups = len(scores_list)
-
-                                    if normality_passed and homogeneity_passed:
-                                        try:
-                                            stat, p_value = f_oneway(*scores_list)
-                                            # check and handle NaN values
-                                            if np.isnan(stat) or np.isnan(p_value):
-                                                
-                                                print(f"Warning: NaN result in ANOVA for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name}")
-                                                print("scores_list",scores_list)
-                                                stat = 0.0
-                                                p_value = 1.0  # most conservative value
-                                            
-                                            test_name = 'ANOVA'
-                                            try:
-                                                tukey_results = pairwise_tukeyhsd(np.concatenate(scores_list), np.concatenate([[i]*len(scores) for i, scores in enumerate(scores_list)]))
-                                            except Exception as e:
-                                                print(f"Error in Tukey test: {e}")
-                                                tukey_results = None
-                                            
-                                            # Calculate ANOVA effect size
-                                            eta_squared, omega_squared, effect_interpretation = calculate_anova_effect_size(scores_list)
-                                            effect_size = eta_squared
-                                            effect_size_type = 'Eta Squared'
-                                            effect_size_secondary = omega_squared
-                                            effect_size_secondary_type = 'Omega Squared'
-                                        except Exception as e:
-                                            print(f"Error in ANOVA: {e}")
-                                            stat = 0.0
-                                            p_value = 1.0  # most conservative value
-                                            test_name = 'ANOVA (Error)'
-                                            tukey_results = None
-                                            effect_size = 0.0
-                                            effect_size_type = 'Eta Squared'
-                                            effect_size_secondary = 0.0
-                                            effect_size_secondary_type = 'Omega Squared'
-                                            effect_interpretation = 'negligible'
-                                    else:
-                                        try:
-                                            stat, p_value = kruskal(*scores_list)
-                                            # check and handle NaN values
-                                            if np.isnan(stat) or np.isnan(p_value):
-                                                print(f"Warning: NaN result in Kruskal-Wallis for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name}")
-                                                stat = 0.0
-                                                p_value = 1.0  # most conservative value
-                                            
-                                            # print(f"Original p-values: {p_value}")  # Kruskal-Wallis 테스트 결과 출력
-                                            test_name = 'Kruskal-Wallis'
-                                            tukey_results = None
-                                            
-                                            # Kruskal-Wallis effect size 계산
-                                            eta_squared, epsilon_squared, effect_interpretation = calculate_kruskal_effect_size(stat, n_total, n_groups)
-                                            effect_size = eta_squared
-                                            effect_size_type = 'Eta Squared'
-                                            effect_size_secondary = epsilon_squared
-                                            effect_size_secondary_type = 'Epsilon Squared'
-                                        except Exception as e:
-                                            print(f"Error in Kruskal-Wallis: {e}")
-                                            stat = 0.0
-                                            p_value = 1.0  # most conservative value
-                                            test_name = 'Kruskal-Wallis (Error)'
-                                            tukey_results = None
-                                            effect_size = 0.0
-                                            effect_size_type = 'Eta Squared'
-                                            effect_size_secondary = 0.0
-                                            effect_size_secondary_type = 'Epsilon Squared'
-                                            effect_interpretation = 'negligible'
-                                except Exception as e:
-                                    print(f"Error during statistical tests: {e}")
-                                    # set default values on error
-                                    normality_passed = False
-                                    homogeneity_passed = False
-                                    stat = 0.0
-                                    p_value = 1.0
-                                    test_name = 'Error'
-                                    tukey_results = None
-                                    effect_size = 0.0
-                                    effect_size_type = 'None'
-                                    effect_size_secondary = 0.0
-                                    effect_size_secondary_type = 'None'
-                                    effect_interpretation = 'negligible'
-
-                                key = (datetime_folder, pir_folder, pf_folder, query, model_name, directness)
-                                pf_model_comparisons[key] = {
-                                    'pf_values': pf_values,
-                                    'test': test_name,
-                                    'stat': stat,
-                                    'p_value': p_value,
-                                    'normality_passed': normality_passed,
-                                    'homogeneity_passed': homogeneity_passed,
-                                    'tukey_results': tukey_results,
-                                    'effect_size': effect_size,
-                                    'effect_size_type': effect_size_type,
-                                    'effect_size_secondary': effect_size_secondary,
-                                    'effect_size_secondary_type': effect_size_secondary_type,
-                                    'effect_interpretation': effect_interpretation
-                                }
-                    else:
-                        # Handling non-search_history folders
-                        pf_values = list(scores_by_pf.keys())
-                        scores_list = [scores_by_pf[pf] for pf in pf_values]
-                        scores_list = ensure_numeric(scores_list)
-                        # for scores in scores_list:
-                        #     print(f"Contains NaN: {np.isnan(scores).any()}")
-                        # print(f"Performing tests for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name} {pf_values}")
-                        # print("scores_list", scores_list)
-                        # print(f"scores_list: {len(scores_list)}")
-                        # print("shape scores_list", [scores.shape for scores in scores_list])
-                        num_comparisons = len(scores_list) * (len(scores_list) - 1) / 2
-                        # print(f"num_comparisons: {num_comparisons}")
-                        if len(scores_list) == 0:
-                            print(f"No data for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name} {pf_values}")
-                        elif len(scores_list) == 1:
-                            print(f"Only one group for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name}. Cannot perform statistical test.")
-                            # set default values when statistical tests cannot be performed
-                            key = (datetime_folder, pir_folder, pf_folder, query, model_name, 'all')
-                            pf_model_comparisons[key] = {
-                                'pf_values': pf_values,
-                                'test': 'None',
-                                'stat': 0.0,
-                                'p_value': 1.0,
-                                'normality_passed': False,
-                                'homogeneity_passed': False,
-                                'tukey_results': None,
-                                'effect_size': 0.0,
-                                'effect_size_type': 'None',
-                                'effect_size_secondary': 0.0,
-                                'effect_size_secondary_type': 'None',
-                                'effect_interpretation': 'negligible'
-                            }
-                        elif len(scores_list) > 1:
-                            try:
-                                normality_passed = all(shapiro(scores)[1] >= 0.05 for scores in scores_list)
-                                homogeneity_passed = levene(*scores_list)[1] >= 0.05
-
-                                # 전체 샘플 수 계산
-                                n_total = sum(len(group) for group in scores_list)
-                                # print(f"n_total: {n_total}")
-                                n_groups = len(scores_list)
-
-                                if normality_passed and homogeneity_passed:
-                                    try:
-                                        stat, p_value = f_oneway(*scores_list)
-                                        # check and handle NaN values
-                                        if np.isnan(stat) or np.isnan(p_value):
-                                            print(f"Warning: NaN result in ANOVA for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name}")
-                                            # print("scores_list",scores_list)
-                                            stat = 0.0
-                                            p_value = 1.0  # most conservative value
-                                        
-                                        test_name = 'ANOVA'
-                                        try:
-                                            tukey_results = pairwise_tukeyhsd(np.concatenate(scores_list), np.concatenate([[i]*len(scores) for i, scores in enumerate(scores_list)]))
-                                        except Exception as e:
-                                            print(f"Error in Tukey test: {e}")
-                                            tukey_results = None
-                                        
-                                        # ANOVA effect size 계산
-                                        eta_squared, omega_squared, effect_interpretation = calculate_anova_effect_size(scores_list)
-                                        effect_size = eta_squared
-                                        effect_size_type = 'Eta Squared'
-                                        effect_size_secondary = omega_squared
-                                        effect_size_secondary_type = 'Omega Squared'
-                                    except Exception as e:
-                                        print(f"Error in ANOVA: {e}")
-                                        stat = 0.0
-                                        p_value = 1.0  # most conservative value
-                                        test_name = 'ANOVA (Error)'
-                                        tukey_results = None
-                                        effect_size = 0.0
-                                        effect_size_type = 'Eta Squared'
-                                        effect_size_secondary = 0.0
-                                        effect_size_secondary_type = 'Omega Squared'
-                                        effect_interpretation = 'negligible'
-                                else:
-                                    try:
-                                        stat, p_value = kruskal(*scores_list)
-                                        # check and handle NaN values
-                                        if np.isnan(stat) or np.isnan(p_value):
-                                            print(f"Warning: NaN result in Kruskal-Wallis for {datetime_folder}, {pir_folder}, {pf_folder}, {query}, {model_name}")
-                                            stat = 0.0
-                                            p_value = 1.0  # most conservative value
-                                        
-                                        # print(f"Kruskal-Wallis Original p-values: {p_value}")  # Kruskal-Wallis 테스트 결과 출력
-                                        test_name = 'Kruskal-Wallis'
-                                        tukey_results = None
-                                        
-                                        # Kruskal-Wallis effect size 계산
-                                        eta_squared, epsilon_squared, effect_interpretation = calculate_kruskal_effect_size(stat, n_total, n_groups)
-                                        effect_size = eta_squared
-                                        effect_size_type = 'Eta Squared'
-                                        effect_size_secondary = epsilon_squared
-                                        effect_size_secondary_type = 'Epsilon Squared'
-                                    except Exception as e:
-                                        print(f"Error in Kruskal-Wallis: {e}")
-                                        stat = 0.0
-                                        p_value = 1.0  # most conservative value
-                                        test_name = 'Kruskal-Wallis (Error)'
-                                        tukey_results = None
-                                        effect_size = 0.0
-                                        effect_size_type = 'Eta Squared'
-                                        effect_size_secondary = 0.0
-                                        effect_size_secondary_type = 'Epsilon Squared'
-                                        effect_interpretation = 'negligible'
-                            except Exception as e:
-                                print(f"Error during statistical tests: {e}")
-                                # set default values on error
-                                normality_passed = False
-                                homogeneity_passed = False
-                                stat = 0.0
-                                p_value = 1.0
-                                test_name = 'Error'
-                                tukey_results = None
-                                effect_size = 0.0
-                                effect_size_type = 'None'
-                                effect_size_secondary = 0.0
-                                effect_size_secondary_type = 'None'
-                                effect_interpretation = 'negligible'
-
-                            key = (datetime_folder, pir_folder, pf_folder, query, model_name, 'all')
-                            pf_model_comparisons[key] = {
-                                'pf_values': pf_values,
-                                'test': test_name,
-                                'stat': stat,
-                                'p_value': p_value,
-                                'normality_passed': normality_passed,
-                                'homogeneity_passed': homogeneity_passed,
-                                'tukey_results': tukey_results,
-                                'effect_size': effect_size,
-                                'effect_size_type': effect_size_type,
-                                'effect_size_secondary': effect_size_secondary,
-                                'effect_size_secondary_type': effect_size_secondary_type,
-                                'effect_interpretation': effect_interpretation
-                            }
-
-# check and handle NaN values
-nan_keys = []
-for key, info in pf_model_comparisons.items():
-    if 'p_value' not in info or np.isnan(info.get('p_value', np.nan)):
-        nan_keys.append(key)
-        # set default values
-        pf_model_comparisons[key]['p_value'] = 1.0
-
-if nan_keys:
-    print(f"Found {len(nan_keys)} keys with missing or NaN p_value before applying corrections")
-
-# apply Bonferroni and Benjamini-Hochberg corrections
-try:
-    pf_model_comparisons = apply_corrections(pf_model_comparisons)
-except Exception as e:
-    print(f"Error during apply_corrections: {e}")
-    # manual correction application
-    for key, info in pf_model_comparisons.items():
-        if 'p_value' in info:
-            p_value = info['p_value']
-            if np.isnan(p_value):
-                p_value = 1.0
-            pf_model_comparisons[key]['bonferroni_p_value'] = min(p_value * 1.0, 1.0)  # single correction
-            pf_model_comparisons[key]['bh_adjusted_p_value'] = min(p_value * 1.0, 1.0)  # single correction
-            pf_model_comparisons[key]['bonferroni_significant'] = False
-            pf_model_comparisons[key]['bh_significant'] = False
-            pf_model_comparisons[key]['correction_group'] = "manual_correction"
-            pf_model_comparisons[key]['group_size'] = 1
-
-# check and handle NaN values again
-nan_keys = []
-for key, info in pf_model_comparisons.items():
-    missing_fields = []
-    for field in ['p_value', 'bonferroni_p_value', 'bh_adjusted_p_value']:
-        if field not in info or np.isnan(info.get(field, np.nan)):
-            missing_fields.append(field)
-    
-    if missing_fields:
-        nan_keys.append((key, missing_fields))
+                    with open(cache_path, 'rb') as f:
+                        comparisons = pickle.load(f)
+                except (pickle.UnpicklingError, EOFError):
+                    # A corrupt cache file is recomputed and overwritten
+                    print(f"Ignoring unreadable cache file: {cache_path}")
+            if comparisons is not None:
+                pending.append((cache_path, None, comparisons))
+            else:
+                pending.append((cache_path, executor.submit(process_pf_folder, *pf_entry), None))
+
+        for cache_path, future, comparisons in pending:
+            if future is not None:
+                comparisons = future.result()
+                write_cache_file(cache_path, comparisons)
+            result_keys.extend(comparisons)
+            result_rows.extend(comparisons.values())
+
+    n_rows = len(result_keys)
+
+    # Transpose the keys and test rows into columns, one pass over each
+    key_fields = list(zip(*result_keys)) if result_keys else [()] * 6
+    test_fields = dict(zip(TestRow._fields, zip(*result_rows))) if result_rows else dict.fromkeys(TestRow._fields, ())
+    columns = {name: np.asarray(values, dtype=object) for name, values in
+               zip(['datetime_folder', 'pir_folder', 'pf_folder', 'query', 'model_name', 'directness'], key_fields)}
+
+    # check and handle NaN values
+    p_values = np.asarray(test_fields['p_value'], dtype=np.float64)
+    nan_count = np.isnan(p_values).sum()
+    if nan_count:
+        print(f"Found {nan_count} keys with NaN p_value before applying corrections")
         # set default values
-        for field in missing_fields:
-            pf_model_comparisons[key][field] = 1.0
-        
-        # set related significant fields
-        if 'bonferroni_p_value' in missing_fields:
-            pf_model_comparisons[key]['bonferroni_significant'] = False
-        if 'bh_adjusted_p_value' in missing_fields:
-            pf_model_comparisons[key]['bh_significant'] = False
-
-if nan_keys:
-    print(f"Found {len(nan_keys)} keys with missing or NaN values after applying corrections")
-
-# save results
-try:
-    results_df = pd.DataFrame([
-        {
-            'datetime_folder': key[0],
-            'pir_folder': key[1],
-            'pf_folder': key[2],
-            'query': key[3].lower(),  # convert query to lowercase to match unique_url_counts_df
-            'model_name': key[4],
-            'directness': key[5],
-            'pf_values': ', '.join(map(str, test_info.get('pf_values', []))),
-            'test': test_info.get('test', 'None'),
-            'stat': test_info.get('stat', 0.0),
-            'p_value': test_info.get('p_value', 1.0),
-            'bonferroni_p_value': test_info.get('bonferroni_p_value', 1.0),
-            'bh_adjusted_p_value': test_info.get('bh_adjusted_p_value', 1.0),
-            'original_significant': test_info.get('p_value', 1.0) < 0.05,
-            'bonferroni_significant': test_info.get('bonferroni_significant', False),
-            'bh_significant': test_info.get('bh_significant', False),
-            'correction_group': test_info.get('correction_group', 'unknown'),
-            'group_size': test_info.get('group_size', 0),
-            'effect_size': test_info.get('effect_size', 0.0),
-            'effect_size_type': test_info.get('effect_size_type', 'None'),
-            'effect_size_secondary': test_info.get('effect_size_secondary', 0.0),
-            'effect_size_secondary_type': test_info.get('effect_size_secondary_type', 'None'),
-            'effect_interpretation': test_info.get('effect_interpretation', 'negligible'),
-            'normality_passed': test_info.get('normality_passed', False),
-            'homogeneity_passed': test_info.get('homogeneity_passed', False),
-            'tukey_results': str(test_info.get('tukey_results', 'N/A'))
+        np.nan_to_num(p_values, copy=False, nan=1.0)
+
+    # apply Bonferroni and Benjamini-Hochberg corrections
+    try:
+        corrections = apply_corrections(columns['pir_folder'], columns['pf_folder'], columns['model_name'], p_values)
+    except Exception as e:
+        print(f"Error during apply_corrections: {e}")
+        # manual correction application (single correction)
+        corrections = {
+            'bonferroni_p_value': np.minimum(p_values, 1.0),
+            'bh_adjusted_p_value': np.minimum(p_values, 1.0),
+            'bonferroni_significant': np.zeros(n_rows, dtype=bool),
+            'bh_significant': np.zeros(n_rows, dtype=bool),
+            'correction_group': np.full(n_rows, "manual_correction", dtype=object),
+            'group_size': np.ones(n_rows, dtype=np.int64)
         }
-        for key, test_info in pf_model_comparisons.items()
-    ])
-except Exception as e:
-    print(f"Error creating results DataFrame: {e}")
-    # safer way to create DataFrame
-    rows = []
-    for key, test_info in pf_model_comparisons.items():
-        try:
-            row = {
-                'datetime_folder': key[0],
-                'pir_folder': key[1],
-                'pf_folder': key[2],
-                'query': key[3].lower(),
-                'model_name': key[4],
-                'directness': key[5],
-                'pf_values': ', '.join(map(str, test_info.get('pf_values', []))),
-                'test': test_info.get('test', 'None'),
-                'stat': test_info.get('stat', 0.0),
-                'p_value': test_info.get('p_value', 1.0),
-                'bonferroni_p_value': test_info.get('bonferroni_p_value', 1.0),
-                'bh_adjusted_p_value': test_info.get('bh_adjusted_p_value', 1.0),
-                'original_significant': test_info.get('p_value', 1.0) < 0.05,
-                'bonferroni_significant': test_info.get('bonferroni_significant', False),
-                'bh_significant': test_info.get('bh_significant', False),
-                'correction_group': test_info.get('correction_group', 'unknown'),
-                'group_size': test_info.get('group_size', 0),
-                'effect_size': test_info.get('effect_size', 0.0),
-                'effect_size_type': test_info.get('effect_size_type', 'None'),
-                'effect_size_secondary': test_info.get('effect_size_secondary', 0.0),
-                'effect_size_secondary_type': test_info.get('effect_size_secondary_type', 'None'),
-                'effect_interpretation': test_info.get('effect_interpretation', 'negligible'),
-                'normality_passed': test_info.get('normality_passed', False),
-                'homogeneity_passed': test_info.get('homogeneity_passed', False),
-                'tukey_results': str(test_info.get('tukey_results', 'N/A'))
-            }
-            rows.append(row)
-        except Exception as e2:
-            print(f"Error processing row {key}: {e2}")
-    
-    results_df = pd.DataFrame(rows)
 
-# final check and correction for NaN values
-for column in results_df.columns:
-    nan_count = results_df[column].isna().sum()
-    if nan_count > 0:
-        print(f"Column {column} has {nan_count} NaN values. Filling with appropriate defaults.")
-        
+    # check and handle NaN values again, together with the related significant fields
+    nan_after = np.zeros(n_rows, dtype=bool)
+    for field, significant_field in [('bonferroni_p_value', 'bonferroni_significant'), ('bh_adjusted_p_value', 'bh_significant')]:
+        nan_mask = np.isnan(corrections[field])
+        corrections[field][nan_mask] = 1.0
+        corrections[significant_field][nan_mask] = False
+        nan_after |= nan_mask
+
+    if nan_after.any():
+        print(f"Found {nan_after.sum()} keys with missing or NaN values after applying corrections")
+
+    # save results; the table is built column by column from the key, test and correction columns
+    # convert query to lowercase to match unique_url_counts_df
+    columns['query'] = np.array([query.lower() for query in key_fields[3]], dtype=object)
+    columns['pf_values'] = np.array([', '.join(map(str, pf_values)) for pf_values in test_fields['pf_values']], dtype=object)
+
+    for name, dtype in RESULT_DTYPES.items():
+        values = corrections[name] if name in corrections else test_fields[name]
+        columns[name] = np.asarray(values, dtype=dtype)
+    columns['p_value'] = p_values
+    columns['original_significant'] = p_values < 0.05
+
+    results_df = pd.DataFrame({name: columns[name] for name in RESULT_COLUMNS}, copy=False)
+
+    # final check and correction for NaN values, in one fillna pass with per-column defaults
+    fill_defaults = {}
+    for column in results_df.columns:
         # set appropriate default values based on data type
-        if column in ['p_value', 'bonferroni_p_value', 'bh_adjusted_p_value', 'stat', 'effect_size', 'effect_size_secondary', 'group_size']:
-            results_df[column] = results_df[column].fillna(0.0 if column == 'stat' else 1.0)
+        if column in ['p_value', 'bonferroni_p_value', 'bh_adjusted_p_value', 'stat', 'effect_size', 'effect_size_secondary', 'group_size', 'tukey_min_p']:
+            fill_defaults[column] = 0.0 if column == 'stat' else 1.0
+        elif column == 'tukey_n_sig':
+            fill_defaults[column] = 0
         elif column in ['original_significant', 'bonferroni_significant', 'bh_significant', 'normality_passed', 'homogeneity_passed']:
-            results_df[column] = results_df[column].fillna(False)
+            fill_defaults[column] = False
         elif column in ['test', 'effect_size_type', 'effect_size_secondary_type', 'effect_interpretation', 'correction_group']:
-            results_df[column] = results_df[column].fillna('None')
+            fill_defaults[column] = 'None'
         else:
-            results_df[column] = results_df[column].fillna('')
-
-# merge unique URL counts and test results
-try:
-    merged_results_df = pd.merge(
-        results_df,
-        unique_url_counts_df,
-        on=['datetime_folder', 'pir_folder', 'pf_folder', 'query'],
-        how='left'
-    )
+            fill_defaults[column] = ''
+
+    nan_counts = results_df.isna().sum()
+    for column, nan_count in nan_counts[nan_counts > 0].items():
+        print(f"Column {column} has {nan_count} NaN values. Filling with appropriate defaults.")
+    if nan_counts.any():
+        results_df = results_df.fillna(value=fill_defaults)
+
+    # merge unique URL counts and test results; the counts are indexed once by the
+    # (already sorted) group keys and looked up per result row
+    try:
+        url_counts = unique_url_counts_df.set_index(['datetime_folder', 'pir_folder', 'pf_folder', 'query'])['Unique_URL_Count']
+        merged_results_df = results_df.join(url_counts, on=['datetime_folder', 'pir_folder', 'pf_folder', 'query'])
     
-    # check for missing values after merge
-    na_count = merged_results_df['Unique_URL_Count'].isna().sum()
-    if na_count > 0:
-        print(f"Warning: {na_count} rows have missing Unique_URL_Count after merge. Filling with 0.")
-        merged_results_df['Unique_URL_Count'] = merged_results_df['Unique_URL_Count'].fillna(0)
-except Exception as e:
-    print(f"Error during merge with unique_url_counts_df: {e}")
-    merged_results_df = results_df
-    merged_results_df['Unique_URL_Count'] = 0  # add default value
-
-# save results
-if not os.path.exists(os.path.join(current_dir, f'4')):
-    os.makedirs(os.path.join(current_dir, f'4'))
-
-try:
-    merged_results_df.to_csv(f'4/tests_{setting_date}.csv', index=False)
-    print(f"Results with unique URL counts saved to 'tests_{setting_date}.csv'")
-except Exception as e:
-    print(f"Error saving CSV file: {e}")
-    # try to save backup file on CSV save failure
+        # check for missing values after merge
+        na_count = merged_results_df['Unique_URL_Count'].isna().sum()
+        if na_count > 0:
+            print(f"Warning: {na_count} rows have missing Unique_URL_Count after merge. Filling with 0.")
+            merged_results_df['Unique_URL_Count'] = merged_results_df['Unique_URL_Count'].fillna(0)
+    except Exception as e:
+        print(f"Error during merge with unique_url_counts_df: {e}")
+        merged_results_df = results_df
+        merged_results_df['Unique_URL_Count'] = 0  # add default value
+
+    for column in CATEGORICAL_COLUMNS:
+        merged_results_df[column] = merged_results_df[column].astype('category')
+
+    # save results
+    if not os.path.exists(os.path.join(current_dir, f'4')):
+        os.makedirs(os.path.join(current_dir, f'4'))
+
     try:
-        merged_results_df.to_csv(f'4/tests_{setting_date}_backup.csv', index=False)
-        print(f"Backup results saved to 'tests_{setting_date}_backup.csv'")
-    except Exception as e2:
-        print(f"Error saving backup CSV file: {e2}")
\ No newline at end of file
+        merged_results_df.to_parquet(f'4/tests_{setting_date}.parquet', engine='pyarrow', compression='zstd', index=False)
+        print(f"Results with unique URL counts saved to 'tests_{setting_date}.parquet'")
+        if WRITE_CSV:
+            merged_results_df.to_csv(f'4/tests_{setting_date}.csv', index=False)
+            print(f"Results with unique URL counts saved to 'tests_{setting_date}.csv'")
+    except Exception as e:
+        print(f"Error saving results file: {e}")
+        # try to save backup file on save failure
+        try:
+            merged_results_df.to_csv(f'4/tests_{setting_date}_backup.csv', index=False)
+            print(f"Backup results saved to 'tests_{setting_date}_backup.csv'")
+        except Exception as e2:
+            print(f"Error saving backup CSV file: {e2}")
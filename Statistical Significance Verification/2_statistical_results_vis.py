@@ -22,10 +22,60 @@ Date: 2024
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
 import matplotlib.dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.colors import to_rgba_array
 import math
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+try:
+    import pyarrow
+except ImportError:  # pyarrow is optional; fall back to the pandas C parser
+    pyarrow = None
+
+def new_figure(figsize):
+    """
+    Create a figure on its own Agg canvas, outside pyplot.
+    
+    The figure is not registered with pyplot's global figure manager, so it
+    needs no plt.close and is freed once it goes out of scope.
+    
+    Args:
+        figsize (tuple): Figure width and height in inches
+        
+    Returns:
+        Figure: The new figure
+    """
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def save_tight(fig, path, **kwargs):
+    """
+    Save a figure cropped to its tight bounding box.
+    
+    The box is measured once on the figure's own renderer (the one
+    tight_layout already used) and passed to savefig as an explicit Bbox,
+    so savefig skips its own measuring pass of bbox_inches='tight'.
+    
+    Args:
+        fig (Figure): Figure to save
+        path (str): Output image path
+        **kwargs: Other savefig arguments (dpi, transparent, ...)
+    """
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(matplotlib.rcParams['savefig.pad_inches'])
+    fig.savefig(path, bbox_inches=bbox, **kwargs)
+
+
+# Legends are a few glyphs each, so they are saved at a lower dpi with maximum PNG compression
+LEGEND_DPI = 150
+LEGEND_PIL_KWARGS = {'optimize': True, 'compress_level': 9}
+
 
 alpha_legend_data = {
     "Negligible (< 0.01)": 0.2,
@@ -45,7 +95,8 @@ def add_effectsize_alpha_legend(base_folder):
     Args:
         base_folder (str): Directory path where the legend image will be saved
     """
-    fig, ax = plt.subplots(figsize=(2, 4))
+    fig = new_figure(figsize=(2, 4))
+    ax = fig.add_subplot()
 
     labels = list(alpha_legend_data.keys())
     alphas = list(alpha_legend_data.values())
@@ -59,48 +110,46 @@ def add_effectsize_alpha_legend(base_folder):
     ax.set_ylim(-1, len(labels))
     ax.axis('off')
 
-    plt.tight_layout()
-    plt.savefig(os.path.join(base_folder, "effect_size_alpha_legend.png"), dpi=600, bbox_inches='tight')
-    plt.close()
+    fig.tight_layout()
+    save_tight(fig, os.path.join(base_folder, "effect_size_alpha_legend.png"), dpi=LEGEND_DPI, pil_kwargs=LEGEND_PIL_KWARGS)
+
+
+# Upper bounds (exclusive) of the negligible, small and medium effect sizes
+EFFECT_SIZE_THRESHOLDS = np.array([0.01, 0.06, 0.14])
+
+# Alpha of negligible, small, medium and large effect sizes
+EFFECT_SIZE_ALPHAS = np.array([0.1, 0.3, 0.9, 1.0])
 
 
 def map_effect_alpha(effect_size):
     """
-    Map effect size to transparency (alpha) value for visualization.
+    Map effect sizes to transparency (alpha) values for visualization.
     
     This function converts numerical effect sizes to transparency values
     for visual representation, with larger effects being more opaque.
     
     Args:
-        effect_size (float): Numerical effect size value
+        effect_size (array-like): Numerical effect size values
         
     Returns:
-        float: Alpha (transparency) value between 0.1 and 1.0
+        np.ndarray: Alpha (transparency) values between 0.1 and 1.0
     """
-    if effect_size < 0.01:
-        return 0.1
-    elif effect_size < 0.06:
-        return 0.3
-    elif effect_size < 0.14:
-        return 0.9
-    else:
-        return 1.0  # Large is still transparent
+    # side='right' so a value equal to a threshold falls in the next band
+    return EFFECT_SIZE_ALPHAS[np.searchsorted(EFFECT_SIZE_THRESHOLDS, np.asarray(effect_size, dtype=float), side='right')]
 
 
 def get_effect_color(effect_size):
     """
-    Determine color based on effect size magnitude.
+    Determine colors based on effect size magnitude.
     
     Args:
-        effect_size (float): Numerical effect size value
+        effect_size (array-like): Numerical effect size values
         
     Returns:
-        str: Hex color code for the effect size
+        np.ndarray: Hex color code for each effect size
     """
-    if effect_size >= 0.14:
-        return '#C70039'  # Dark red for large effects
-    else:
-        return '#FF4500'  # Orange for smaller effects
+    # Dark red for large effects, orange for smaller effects
+    return np.where(np.asarray(effect_size, dtype=float) >= 0.14, '#C70039', '#FF4500')
 
 
 def create_model_legend(df, base_folder='5_1'):
@@ -115,10 +164,10 @@ def create_model_legend(df, base_folder='5_1'):
         df (pd.DataFrame): DataFrame containing model information
         base_folder (str): Directory path where the legend will be saved
     """
-    import matplotlib.pyplot as plt
     import os
 
-    fig, ax = plt.subplots(figsize=(10, 0.5))
+    fig = new_figure(figsize=(10, 0.5))
+    ax = fig.add_subplot()
     markers = ['8', '*']
     color = '#FF4500'
     
@@ -134,14 +183,12 @@ def create_model_legend(df, base_folder='5_1'):
     ax.legend(loc='center', bbox_to_anchor=(0.5, 0.5), ncol=len(markers)+2)
     ax.axis('off')
     
-    plt.tight_layout()
+    fig.tight_layout()
     os.makedirs(base_folder, exist_ok=True)
-    plt.savefig(os.path.join(base_folder, "model_legend.png"), dpi=600, bbox_inches='tight')
-    plt.close()
+    save_tight(fig, os.path.join(base_folder, "model_legend.png"), dpi=LEGEND_DPI, pil_kwargs=LEGEND_PIL_KWARGS)
 
 
 def create_effectsize_legend(base_folder='5_1'):
-    import matplotlib.pyplot as plt
     import os
 
     alpha_legend_data = {
@@ -151,7 +198,8 @@ def create_effectsize_legend(base_folder='5_1'):
         "Large (≥ 0.14)": 1.0
     }
 
-    fig, ax = plt.subplots(figsize=(10, 0.5))
+    fig = new_figure(figsize=(10, 0.5))
+    ax = fig.add_subplot()
     # color = '#FF4500'
     colors = ['#FF4500', '#FF4500', '#FF4500', '#C70039']  # Last one is red
 
@@ -166,178 +214,259 @@ def create_effectsize_legend(base_folder='5_1'):
     )
     
     path = os.path.join(base_folder, 'legend_effectsize.png')
-    plt.savefig(path, dpi=600, bbox_inches='tight', transparent=False)
-    plt.close()
+    save_tight(fig, path, dpi=LEGEND_DPI, transparent=False, pil_kwargs=LEGEND_PIL_KWARGS)
+
 
 
+# Define user context name mapping and order
+context_mapping = {
+    'user_agent': 'E',
+    'accept_language': 'L',
+    'region': 'G',
+    'search_history': 'S'
+}
+context_order = ['S', 'G', 'L', 'E']
+# Mapped contexts in plot order; the category codes are the contexts' x offsets within a date
+context_dtype = pd.CategoricalDtype(categories=context_order, ordered=True)
 
 
-def create_grid_plots(df, base_folder='5_1'):
-    plt.rcParams['font.family'] = 'DeJavu Serif'
-    plt.rcParams['font.serif'] = ['Times New Roman']
-    plt.rcParams['font.size'] = 18  # Increase font size for better readability
-    
-    os.makedirs(base_folder, exist_ok=True)
-    create_model_legend(df, base_folder)
-    create_effectsize_legend(base_folder)
-    
-    
-    # Define user context name mapping and order
-    context_mapping = {
-        'user_agent': 'E',
-        'accept_language': 'L',
-        'region': 'G',
-        'search_history': 'S'
-    }
-    context_order = ['S', 'G', 'L', 'E']
+# Fonts of the grid plots and their legends, applied with matplotlib.rc_context so the
+# global rcParams stay untouched
+grid_plot_rc = {
+    'font.family': 'DeJavu Serif',
+    'font.serif': ['Times New Roman'],
+    'font.size': 18,  # Increase font size for better readability
+}
+
+
+@matplotlib.rc_context(grid_plot_rc)
+def render_engine(search_engine, columns, unique_queries, base_folder):
+    """
+    Draw and save the p-value grid of one search engine.
     
-    df['query'] = df['query'].str.upper()
-    unique_queries = sorted(df['query'].unique())
-    search_engines = sorted(df['pir_folder'].unique())
+    Runs in a worker process, so it only relies on its arguments and on
+    module-level settings.
     
+    Args:
+        search_engine (str): Search engine (pir_folder) to plot
+        columns (dict): NumPy array per plotted field (see create_grid_plots) holding the
+            rows of that search engine, sorted by query, date and context
+        unique_queries (list): All queries, one subplot each in this order
+        base_folder (str): Directory where the image is saved
+        
+    Returns:
+        str: Path of the saved image
+    """
     markers = ['8', '*']  # Use consistent markers
-    colors = ['#FF4500', '#FF4500']  # Complementary colors
     
     n_queries = len(unique_queries)
     n_cols = 3
     n_rows = math.ceil(n_queries / n_cols)
     
-    # Apply context name mapping
-    df['pf_folder_mapped'] = df['pf_folder'].map(context_mapping)
+    # Rows of each query are contiguous; a query without rows still gets its (empty) subplot
+    query_bounds = np.searchsorted(columns['query_code'], np.arange(n_queries + 1))
+    
+    # Text properties shared by all date labels and all URL count labels
+    date_text_kwargs = dict(ha='center', va='top', fontsize=18, fontweight='bold')
+    url_count_text_kwargs = dict(fontsize=13, rotation=80, alpha=0.8, color='black', ha='center', va='center')
+    
+    fig = new_figure(figsize=(18, 4*n_rows))
     
-    for search_engine in search_engines:
-        fig = plt.figure(figsize=(18, 4*n_rows))
+    for idx, query in enumerate(unique_queries, 1):
+        rows = slice(query_bounds[idx - 1], query_bounds[idx])
         
-        for idx, query in enumerate(unique_queries, 1):
-            query_data = df[(df['query'] == query) & 
-                          (df['pir_folder'] == search_engine)].copy()
-            
-            query_data['datetime_folder'] = pd.to_datetime(query_data['datetime_folder'])
-            query_data = query_data.sort_values(['datetime_folder', 'pf_folder_mapped'])
-            
-            ax = fig.add_subplot(n_rows, n_cols, idx)
-            
-            unique_dates = sorted(query_data['datetime_folder'].unique())
-            n_contexts = len(context_order)
-            
-            tick_positions = []
-            tick_labels = []
-            date_positions = []
-            
-            for date_idx, date in enumerate(unique_dates):
-                base_pos = date_idx * (n_contexts + 1)
-                date_positions.append(base_pos + n_contexts / 2)
-                
-                for ctx_idx, context in enumerate(context_order):
-                    pos = base_pos + ctx_idx
-                    tick_positions.append(pos)
-                    tick_labels.append(context)
-                    
-                    date_data = query_data[query_data['datetime_folder'] == date]
-                    context_data = date_data[date_data['pf_folder_mapped'] == context]
-                    
-                    # Track if count text is already added for this context
-                    count_text_added = False
-
-                    for model_idx, model in enumerate(sorted(context_data['model_name'].unique())):
-                        model_data = context_data[context_data['model_name'] == model]
-                        
-                        if not model_data.empty:
-                            # Scatter the marker
-                            # bh_adjusted_p_value
-                            # bonferroni_p_value
-                            pval = model_data['bh_adjusted_p_value'].iloc[0]
-                            effect = model_data['effect_size'].iloc[0]
-                            url_count = model_data['Unique_URL_Count'].iloc[0]
-                            alpha_val = map_effect_alpha(effect)
-                            color_val = get_effect_color(effect)
-                            # Plot the point
-                            ax.scatter([pos],
-                                    [pval],
-                                    marker=markers[model_idx % len(markers)],
-                                    color=color_val,
-                                    s=400,
-                                    alpha=alpha_val,
-                                    zorder=3)
-
-                            if pval < 0.05:
-                                ax.scatter([pos],
-                                        [pval],
-                                        marker=markers[model_idx % len(markers)],
-                                        color=color_val,
-                                        s=400,
-                                        alpha=alpha_val,
-                                        edgecolor='black',
-                                        linewidth=1.5,
-                                        zorder=5)
-
-                            # Unique URL count text
-                            if not count_text_added:
-                                # Display all URL count text in the middle of the chart (y=0.5)
-                                ax.text(pos,
-                                        0.5,  # Always display in the middle of the chart
-                                        f'{url_count}',
-                                        fontsize=13,
-                                        rotation=80,
-                                        alpha=0.8,
-                                        color='black',
-                                        ha='center',
-                                        va='center')
-                                count_text_added = True
-                            
-                if date_idx < len(unique_dates) - 1:
-                    ax.axvline(x=base_pos + n_contexts + 0.5,
-                             color='lightgray',
-                             linestyle='-',
-                             alpha=0.3,
-                             zorder=1)
-                
-                # Label dates
-                ax.text(base_pos + n_contexts / 2, 
-                       -0.15, 
-                       date.strftime('%m-%d'),
-                       ha='center',
-                       va='top',
-                       transform=ax.get_xaxis_transform(),
-                       fontsize=18,
-                       fontweight='bold')
-            
-            ax.set_title(f'{query}', fontsize=18)
-            ax.grid(True, linestyle='--', alpha=0.3)
-            ax.set_ylim(-0.05, 1.15)
-            
-            ax.set_xticks(tick_positions)
-            ax.set_xticklabels(tick_labels, 
-                             rotation=0, 
-                             ha='center',
-                             fontsize=18)
-            
-            # ax.set_ylabel('P-value', fontsize=14)
-            ## Change to highlight
-            ax.axhline(y=0.05, color='blue', linestyle=':', alpha=1, zorder=0)
-            
-        # fig.suptitle(f'P-value Trends ({search_engine})', fontsize=20, y=1.02)
-        plt.tight_layout()
+        ax = fig.add_subplot(n_rows, n_cols, idx)
         
-        filename = os.path.join(base_folder, f'p_value_trends_{search_engine}.png')
-        plt.savefig(filename, dpi=600, bbox_inches='tight')
-        plt.close()
+        unique_dates, date_idx = np.unique(columns['date'][rows], return_inverse=True)
+        n_contexts = len(context_order)
+        n_dates = len(unique_dates)
         
-        print(f"Created visualization for {search_engine}")
+        # Each date is a block of one tick per context, followed by a one-tick gap
+        base_positions = np.arange(n_dates) * (n_contexts + 1)
+        tick_positions = (base_positions[:, None] + np.arange(n_contexts)).ravel()
+        tick_labels = np.tile(context_order, n_dates)
+        date_positions = base_positions + n_contexts / 2
+        
+        # Separators between consecutive dates, as one line collection
+        if n_dates > 1:
+            ax.vlines(base_positions[:-1] + n_contexts + 0.5,
+                      0,
+                      1,
+                      transform=ax.get_xaxis_transform(),
+                      colors='lightgray',
+                      linestyles='-',
+                      alpha=0.3,
+                      zorder=1)
+        
+        # Label dates
+        date_transform = ax.get_xaxis_transform()
+        for date_pos, date_label in zip(date_positions, pd.DatetimeIndex(unique_dates).strftime('%m-%d')):
+            ax.text(date_pos, 
+                   -0.15, 
+                   date_label,
+                   transform=date_transform,
+                   **date_text_kwargs)
+        
+        # Points ordered by model; position of every (date, context) point
+        by_model = np.argsort(columns['model_code'][rows], kind='stable')
+        positions = (date_idx * (n_contexts + 1) + columns['context_code'][rows])[by_model]
+        # Marker of each point: index of its model among all models, so a model keeps
+        # its marker at every position even where another model is missing
+        model_idx = columns['model_code'][rows][by_model]
+        # bh_adjusted_p_value
+        # bonferroni_p_value
+        pvals = columns['p_value'][rows][by_model]
+        rgba = columns['rgba'][rows][by_model]
+        # Black outline with the same alpha as the marker
+        edge_rgba = np.zeros_like(rgba)
+        edge_rgba[:, 3] = rgba[:, 3]
+
+        # One scatter per marker for all points, plus one per marker outlining significant points;
+        # the markers are rasterized while axes and text stay vector in vector outputs
+        for marker_idx, marker in enumerate(markers):
+            in_marker = (model_idx % len(markers)) == marker_idx
+            if in_marker.any():
+                ax.scatter(positions[in_marker],
+                        pvals[in_marker],
+                        marker=marker,
+                        c=rgba[in_marker],
+                        s=400,
+                        rasterized=True,
+                        zorder=3)
+            significant = in_marker & (pvals < 0.05)
+            if significant.any():
+                ax.scatter(positions[significant],
+                        pvals[significant],
+                        marker=marker,
+                        c=rgba[significant],
+                        s=400,
+                        edgecolors=edge_rgba[significant],
+                        linewidths=1.5,
+                        rasterized=True,
+                        zorder=5)
+
+        # Unique URL count text, once per position (from its first model)
+        _, first_at_position = np.unique(positions, return_index=True)
+        for pos, url_count in zip(positions[first_at_position],
+                                  columns['url_count'][rows][by_model][first_at_position]):
+            # Display all URL count text in the middle of the chart (y=0.5)
+            ax.text(pos,
+                    0.5,  # Always display in the middle of the chart
+                    f'{url_count}',
+                    **url_count_text_kwargs)
+        
+        ax.set_title(f'{query}', fontsize=18)
+        ax.grid(True, linestyle='--', alpha=0.3)
+        ax.set_ylim(-0.05, 1.15)
+        
+        ax.set_xticks(tick_positions)
+        ax.set_xticklabels(tick_labels, 
+                         rotation=0, 
+                         ha='center',
+                         fontsize=18)
+        
+        # ax.set_ylabel('P-value', fontsize=14)
+        ## Change to highlight
+        ax.axhline(y=0.05, color='blue', linestyle=':', alpha=1, zorder=0)
+        
+    # fig.suptitle(f'P-value Trends ({search_engine})', fontsize=20, y=1.02)
+    fig.tight_layout()
+    
+    filename = os.path.join(base_folder, f'p_value_trends_{search_engine}.png')
+    save_tight(fig, filename, dpi=600)
+    return filename
+
+
+def create_grid_plots(df, unique_queries, search_engines, model_names, base_folder='5_1'):
+    os.makedirs(base_folder, exist_ok=True)
+    with matplotlib.rc_context(grid_plot_rc):
+        create_model_legend(df, base_folder)
+        create_effectsize_legend(base_folder)
+    
+    # Sort once; every search engine and query below keeps this date/context order
+    df = df.sort_values(['pir_folder', 'query', 'datetime_folder', 'pf_folder_mapped'],
+                        kind='mergesort', ignore_index=True)
+    
+    # Struct of arrays: one NumPy array per plotted field, so plotting needs no pandas indexing
+    rgba = to_rgba_array(df['effect_color'].tolist())
+    rgba[:, 3] = df['effect_alpha'].to_numpy(dtype=float)
+    columns = {
+        'query_code': pd.Categorical(df['query'], categories=unique_queries).codes,
+        'date': df['datetime_folder'].to_numpy(dtype='datetime64[ns]'),
+        'context_code': df['pf_folder_mapped'].cat.codes.to_numpy(),
+        'model_code': pd.Categorical(df['model_name'], categories=model_names).codes,
+        'p_value': df['bh_adjusted_p_value'].to_numpy(dtype=float, na_value=np.nan),
+        'rgba': rgba,
+        'url_count': df['Unique_URL_Count'].to_numpy(),
+    }
+    # Rows of each search engine are contiguous after the sort
+    engine_bounds = np.searchsorted(pd.Categorical(df['pir_folder'], categories=search_engines).codes,
+                                    np.arange(len(search_engines) + 1))
+    
+    # Each search engine is an independent image; render them in parallel, passing
+    # every worker only the rows of its engine
+    max_workers = max(1, min(len(search_engines), os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        filenames = executor.map(render_engine,
+                                 search_engines,
+                                 [{name: values[start:stop] for name, values in columns.items()}
+                                  for start, stop in zip(engine_bounds[:-1], engine_bounds[1:])],
+                                 repeat(unique_queries),
+                                 repeat(base_folder))
+        for search_engine, _ in zip(search_engines, filenames):
+            print(f"Created visualization for {search_engine}")
+
+def read_results_csv(file_path):
+    """
+    Read a test results CSV, using the multithreaded pyarrow parser when available.
+    
+    Args:
+        file_path (str): Path to the CSV file
+        
+    Returns:
+        pd.DataFrame: Loaded data
+    """
+    if pyarrow is not None:
+        return pd.read_csv(file_path, engine='pyarrow', dtype_backend='pyarrow')
+    return pd.read_csv(file_path)
+
 
 def main(df, base_folder='4'):
-    # Include only 'political' and 'stance' columns, apply model_name filter
-    df = df[df['model_name'].isin(['Political_Score', 'Stance_Score'])]
+    # Include only 'political' and 'stance' columns, apply model_name filter on the
+    # integer category codes instead of the strings
+    model_name = df['model_name'].astype('category')
+    model_codes = model_name.cat.categories.get_indexer(['Political_Score', 'Stance_Score'])
+    keep = model_name.cat.codes.isin(model_codes[model_codes >= 0])
+    df = df[keep]
+    # Strip the score suffix once ('Political', 'Stance'), on the remaining categories only
+    df['model_name'] = (model_name[keep].cat.remove_unused_categories()
+                        .cat.rename_categories(lambda name: name.removesuffix('_Score')))
+    # Only the mapped user contexts are plotted; drop the other rows up front
+    df = df[df['pf_folder'].isin(list(context_mapping))]
+    df['pf_folder_mapped'] = df['pf_folder'].map(context_mapping).astype(context_dtype)
     df['datetime_folder'] = pd.to_datetime(df['datetime_folder'])
+    # Marker alpha and color of every row, from its effect size
+    df['effect_alpha'] = map_effect_alpha(df['effect_size'])
+    df['effect_color'] = get_effect_color(df['effect_size'])
+    df['query'] = df['query'].str.upper()
     df = df.sort_values(['query', 'datetime_folder', 'model_name', 'pir_folder'])
-    create_grid_plots(df, base_folder)
+    # Sorted distinct values, computed once: one subplot per query, one image per
+    # search engine and one marker per model
+    unique_queries = np.sort(df['query'].unique())
+    search_engines = np.sort(df['pir_folder'].unique())
+    model_names = np.sort(df['model_name'].unique())
+    create_grid_plots(df, unique_queries, search_engines, model_names, base_folder)
 
 if __name__ == "__main__":
     # 2024-09
     # 0921-30
     setting_date = '0921-30'
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    csv_path = os.path.join(current_dir, f'4/tests_{setting_date}.csv')
-    df = pd.read_csv(csv_path)
+    # Prefer the Parquet results; fall back to a CSV written with WRITE_CSV
+    parquet_path = os.path.join(current_dir, f'4/tests_{setting_date}.parquet')
+    if os.path.exists(parquet_path):
+        df = pd.read_parquet(parquet_path)
+    else:
+        df = read_results_csv(os.path.join(current_dir, f'4/tests_{setting_date}.csv'))
     print(df.head())
     main(df)
\ No newline at end of file